@@ -0,0 +1,306 @@
+import numpy as np
+import time
+import tracemalloc
+from load_data import load_dataset
+from ferm import PFERM
+from sharded_ferm import ShardedPFERM
+from multiclass_ferm import MulticlassPFERM
+from measures import evaluate
+import argparse
+from sklearn.base import clone
+
+
+def fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi):
+    # fit the algorithm and return its test accuracy, DEO and fit time
+    start_time = time.perf_counter()
+    algorithm.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start_time
+    train_acc, train_bacc, test_acc, test_bacc, DEO, DDP \
+        = evaluate(X_train, X_test, y_train, y_test, algorithm, sensible_feature_idx, pi)
+    return test_acc, DEO, fit_time
+
+
+def compare_approx(dataset, args, seed=0):
+    # accuracy and DEO of the approximate kernel modes against the exact PFERM solver
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+
+    settings = [('exact', {})]
+    for n_components in args.n_components:
+        settings.append(('nystroem_{}'.format(n_components),
+                         {'kernel_approx': 'nystroem', 'n_components': n_components, 'random_state': seed}))
+        settings.append(('rff_{}'.format(n_components),
+                         {'kernel_approx': 'rff', 'n_components': n_components, 'random_state': seed}))
+
+    result = {}
+    for name, params in settings:
+        print('-----{}------'.format(name))
+        algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma,
+                          prior=True, pi=pi, constraint=args.constraint, lamda=args.lamda, n_threads=args.n_threads,
+                          **params)
+        result[name] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi)
+
+    print('\n{:<16}{:>8}{:>8}{:>10}'.format('method', 'ACC', 'DEO', 'time(s)'))
+    for name, (acc, DEO, fit_time) in result.items():
+        print('{:<16}{:>8.4f}{:>8.4f}{:>10.2f}'.format(name, acc, DEO, fit_time))
+    return result
+
+
+def compare_sharded(dataset, args, seed=0):
+    # accuracy and DEO gap of the sharded training against the monolithic solve
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+    algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma,
+                      prior=True, pi=pi, constraint=args.constraint, lamda=args.lamda, solver=args.solver,
+                      n_threads=args.n_threads)
+
+    result = {}
+    print('-----monolithic------')
+    result['monolithic'] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi)
+    for n_shards in args.n_shards:
+        name = 'sharded_{}'.format(n_shards)
+        print('-----{}------'.format(name))
+        sharded = ShardedPFERM(algorithm, n_shards=n_shards, n_jobs=args.n_jobs, random_state=seed)
+        result[name] = fit_evaluate(sharded, X_train, X_test, y_train, y_test, sensible_feature_idx, pi)
+        print('support vectors of the shards: {}, merged set: {}'
+              .format(sharded.shard_n_sv, len(sharded.support_index)))
+
+    acc_0, DEO_0, _ = result['monolithic']
+    print('\n{:<16}{:>8}{:>8}{:>10}{:>10}{:>10}'.format('method', 'ACC', 'DEO', 'time(s)', 'ACC gap', 'DEO gap'))
+    for name, (acc, DEO, fit_time) in result.items():
+        print('{:<16}{:>8.4f}{:>8.4f}{:>10.2f}{:>10.4f}{:>10.4f}'
+              .format(name, acc, DEO, fit_time, acc - acc_0, DEO - DEO_0))
+    return result
+
+
+def compare_dtype(datasets, args, seed=0):
+    # drift of the accuracy, DEO and decision values of the float32 mode against float64, with the bytes of
+    # the largest arrays of each fit, the rows of a dataset are printed as soon as its two fits complete
+    result = {}
+    row = '{:<20}{:>8.4f}{:>8.4f}{:>10.2f}{:>12.1f}{:>10.4f}{:>10.4f}{:>12.2e}'
+    print('{:<20}{:>8}{:>8}{:>10}{:>12}{:>10}{:>10}{:>12}'
+          .format('method', 'ACC', 'DEO', 'time(s)', 'peak(MB)', 'ACC gap', 'DEO gap', 'max|df gap|'))
+    for dataset in datasets:
+        try:
+            X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+        except FileNotFoundError as error:
+            print('{:<20}skipped, {}'.format(dataset, error))
+            continue
+        decisions = {}
+        for dtype in (np.float64, np.float32):
+            name = '{}_{}'.format(dataset, np.dtype(dtype).name)
+            algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma,
+                              prior=True, pi=pi, constraint=args.constraint, lamda=args.lamda, solver=args.solver,
+                              dtype=dtype, n_threads=args.n_threads)
+            result[name] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi) \
+                + (algorithm.fit_stats_['peak_bytes'],)
+            decisions[dtype] = algorithm.decision_function(X_test)
+        result[dataset + '_drift'] = np.max(np.abs(decisions[np.float32] - decisions[np.float64]))
+
+        acc_0, DEO_0, _, _ = result[dataset + '_float64']
+        for dtype in ('float64', 'float32'):
+            acc, DEO, fit_time, peak_bytes = result['{}_{}'.format(dataset, dtype)]
+            drift = result[dataset + '_drift'] if dtype == 'float32' else 0.0
+            print(row.format('{}_{}'.format(dataset, dtype), acc, DEO, fit_time, peak_bytes / 2 ** 20,
+                             acc - acc_0, DEO - DEO_0, drift), flush=True)
+    return result
+
+
+def compare_penalty(dataset, args, seed=0):
+    # accuracy and DEO of the penalized formulation (coordinate descent) along mu, against the constrained solution
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+    settings = [('constraint', {'solver': args.solver})]
+    for mu in args.mu:
+        settings.append(('penalty_{:g}'.format(mu), {'solver': 'smo', 'fairness_mode': 'penalty', 'mu': mu}))
+
+    result = {}
+    for name, params in settings:
+        print('-----{}------'.format(name))
+        algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, prior=True, pi=pi,
+                          constraint=args.constraint, lamda=args.lamda, n_threads=args.n_threads, **params)
+        result[name] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi)
+        # the violation |F a| of the fairness rows left on the training set
+        fairness_rows = y_train * np.array(algorithm.tau_list)
+        sv_alpha = np.zeros(len(X_train))
+        sv_alpha[algorithm.sv_index] = algorithm.a
+        result[name] += (np.max(np.abs(fairness_rows.dot(sv_alpha))),)
+
+    acc_0, DEO_0, _, _ = result['constraint']
+    print('\n{:<16}{:>8}{:>8}{:>10}{:>10}{:>10}{:>12}'
+          .format('method', 'ACC', 'DEO', 'time(s)', 'ACC gap', 'DEO gap', 'max|F a|'))
+    for name, (acc, DEO, fit_time, violation) in result.items():
+        print('{:<16}{:>8.4f}{:>8.4f}{:>10.2f}{:>10.4f}{:>10.4f}{:>12.2e}'
+              .format(name, acc, DEO, fit_time, acc - acc_0, DEO - DEO_0, violation))
+    return result
+
+
+def compare_dedup(dataset, args, seed=0):
+    # size of the QP, accuracy, DEO and fit time with and without collapsing the duplicate training rows
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+
+    result = {}
+    for dedup in (False, True):
+        name = 'dedup' if dedup else 'all_rows'
+        print('-----{}------'.format(name))
+        algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, prior=True, pi=pi,
+                          constraint=args.constraint, lamda=args.lamda, solver=args.solver, n_threads=args.n_threads,
+                          dedup=dedup)
+        result[name] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi) \
+            + (algorithm.fit_stats_['n_samples'],)
+
+    acc_0, DEO_0, _, _ = result['all_rows']
+    print('\n{:<16}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}'
+          .format('method', 'n', 'ACC', 'DEO', 'time(s)', 'ACC gap', 'DEO gap'))
+    for name, (acc, DEO, fit_time, n_samples) in result.items():
+        print('{:<16}{:>8}{:>8.4f}{:>8.4f}{:>10.2f}{:>10.4f}{:>10.4f}'
+              .format(name, n_samples, acc, DEO, fit_time, acc - acc_0, DEO - DEO_0))
+    return result
+
+
+def compare_screening(dataset, args, seed=0):
+    # samples screened before the dense QP, fit time and drift of the decision values against the unscreened fit
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+
+    result, decisions = {}, {}
+    for screening in (False, True):
+        name = 'screening' if screening else 'no_screening'
+        print('-----{}------'.format(name))
+        algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, prior=True, pi=pi,
+                          constraint=args.constraint, lamda=args.lamda, solver=args.solver, n_threads=args.n_threads,
+                          screening=screening)
+        result[name] = fit_evaluate(algorithm, X_train, X_test, y_train, y_test, sensible_feature_idx, pi) \
+            + (algorithm.fit_stats_['n_screened'] or 0, algorithm.fit_stats_['n_sv'])
+        decisions[name] = algorithm.decision_function(X_test)
+    drift = np.max(np.abs(decisions['screening'] - decisions['no_screening']))
+
+    print('\n{:<16}{:>8}{:>8}{:>10}{:>10}{:>8}{:>12}'
+          .format('method', 'ACC', 'DEO', 'time(s)', 'screened', 'n_sv', 'max|df gap|'))
+    for name, (acc, DEO, fit_time, n_screened, n_sv) in result.items():
+        print('{:<16}{:>8.4f}{:>8.4f}{:>10.2f}{:>10}{:>8}{:>12.2e}'
+              .format(name, acc, DEO, fit_time, n_screened, n_sv, drift if name == 'screening' else 0.0))
+    return result
+
+
+def compare_multiclass(dataset, args, seed=0):
+    # the multi-class PFERM on one shared Gram matrix against a separate binary PFERM for every subproblem
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+    algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, prior=True,
+                      constraint=args.constraint, lamda=args.lamda, solver=args.solver, n_threads=args.n_threads)
+
+    result = {}
+    for strategy in ('ovr', 'ovo'):
+        print('-----{}------'.format(strategy))
+        start_time = time.perf_counter()
+        multiclass = MulticlassPFERM(algorithm, strategy=strategy, pi=pi, n_jobs=args.n_jobs).fit(X_train, y_train)
+        shared_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        drift = 0.0
+        for key, model in multiclass.estimators_.items():
+            positive = key if strategy == 'ovr' else key[1]
+            idx = np.ones(len(y_train), dtype=bool) if strategy == 'ovr' else np.isin(y_train, key)
+            separate = clone(algorithm).set_params(pi=pi[positive])
+            separate.fit(X_train[idx], np.where(y_train[idx] == positive, 1.0, -1.0))
+            drift = max(drift, np.max(np.abs(separate.decision_function(X_test) - model.decision_function(X_test))))
+        result[strategy] = (multiclass.score(X_test, y_test), shared_time, time.perf_counter() - start_time, drift)
+
+    print('\n{:<16}{:>8}{:>12}{:>14}{:>12}'.format('method', 'ACC', 'shared(s)', 'separate(s)', 'max|df gap|'))
+    for name, (acc, shared_time, separate_time, drift) in result.items():
+        print('{:<16}{:>8.4f}{:>12.2f}{:>14.2f}{:>12.2e}'.format(name, acc, shared_time, separate_time, drift))
+    return result
+
+
+def check_warm_start(dataset, args, seed=0):
+    # the models of fit_sweep and partial_fit, warm started from multipliers solved for other fairness rows,
+    # against cold fits of the same problems, the decision values must agree within max_drift
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+    algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, constraint=args.constraint,
+                      solver=args.solver, incremental=True, n_threads=args.n_threads)
+    priors = [(pi_k, args.lamda) for pi_k in args.pi]
+    warm = list(zip(['sweep_pi_{}'.format(pi_k) for pi_k, _ in priors], algorithm.fit_sweep(X_train, y_train, priors)))
+    cold = [clone(algorithm).set_params(prior=True, pi=pi_k, lamda=lamda).fit(X_train, y_train)
+            for pi_k, lamda in priors]
+    m = len(X_train) * 3 // 4
+    warm.append(('partial_fit', clone(algorithm).fit(X_train[:m], y_train[:m]).partial_fit(X_train[m:], y_train[m:])))
+    cold.append(clone(algorithm).fit(X_train, y_train))
+
+    print('\n{:<16}{:>10}{:>12}'.format('method', 'status', 'max|df gap|'))
+    drifts = []
+    for (name, model), reference in zip(warm, cold):
+        drift = np.max(np.abs(model.decision_function(X_test) - reference.decision_function(X_test)))
+        drifts.append(drift)
+        print('{:<16}{:>10}{:>12.2e}'.format(name, model.fit_stats_['status'], drift))
+    assert max(drifts) <= args.max_drift, \
+        'the warm started models drift by {:.2e} from the cold fits, above {}'.format(max(drifts), args.max_drift)
+    return drifts
+
+
+def check_memory(dataset, args, seed=0):
+    # the traced peak of a cvxopt fit against one n x n array of doubles: P is formed in place over K, so the
+    # fit should hold about one Gram matrix, at most max_ratio * n^2 * 8 bytes. The O(n) vectors of the interior
+    # point method are a few percent of n^2 only from n ~ 1000 on, e.g. the default adult
+    X_train, X_test, y_train, y_test, sensible_feature_idx, pi = load_dataset(dataset, seed)
+    if args.n_samples is not None:
+        X_train, y_train = X_train[:args.n_samples], y_train[:args.n_samples]
+    algorithm = PFERM(sensible_feature=sensible_feature_idx, C=args.C, gamma=args.gamma, prior=True, pi=pi,
+                      constraint=args.constraint, lamda=args.lamda, solver='cvxopt', n_threads=args.n_threads)
+    gram_bytes = len(X_train) ** 2 * np.dtype(np.double).itemsize
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    algorithm.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('\n{:<16}{:>8}{:>12}{:>12}{:>10}{:>10}'.format('dataset', 'n', 'n^2(MB)', 'peak(MB)', 'ratio', 'time(s)'))
+    print('{:<16}{:>8}{:>12.1f}{:>12.1f}{:>10.3f}{:>10.2f}'
+          .format(dataset, len(X_train), gram_bytes / 2 ** 20, peak / 2 ** 20, peak / gram_bytes, fit_time))
+    assert peak <= args.max_ratio * gram_bytes, \
+        'the cvxopt fit peaked at {:.3f} n^2 doubles, above {}'.format(peak / gram_bytes, args.max_ratio)
+    return peak / gram_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--experiment", type=str, help="approx, sharded, dtype, penalty, dedup, screening, multiclass, memory or warm_start", default="approx")
+    parser.add_argument("--dataset", type=str, help="dataset name", default="adult")
+    parser.add_argument("--datasets", type=str, nargs='+', help="dataset names of the dtype experiment, "
+                        "the bundled ones by default", default=['toy_new', 'toy_3', 'adult'])
+    parser.add_argument("--constraint", type=str, help="EO or DP as constrain", default='EO')
+    parser.add_argument("--lamda", type=float, help="the trade-off parameter of the pi", default=0.5)
+    parser.add_argument("--C", type=float, help="the regularization parameter", default=1.0)
+    parser.add_argument("--gamma", type=float, help="the parameter of the rbf kernel", default=0.1)
+    parser.add_argument("--n_components", type=int, nargs='+', help="dimensions of the feature maps",
+                        default=[100, 500])
+    parser.add_argument("--solver", type=str, help="the solver of PFERM", default='cvxopt')
+    parser.add_argument("--n_shards", type=int, nargs='+', help="numbers of shards", default=[2, 4, 8])
+    parser.add_argument("--n_jobs", type=int, help="worker processes of the sharded and multi-class training", default=None)
+    parser.add_argument("--n_threads", type=int, help="BLAS threads of each fit, by default all the cores for a "
+                                                   "single fit and an even share for the shards", default=None)
+    parser.add_argument("--mu", type=float, nargs='+', help="weights of the fairness penalty",
+                        default=[0.1, 1.0, 10.0, 100.0, 1000.0])
+    parser.add_argument("--n_samples", type=int, help="training samples of the memory check, all by default",
+                        default=None)
+    parser.add_argument("--max_ratio", type=float, help="bound of the memory check on the traced peak of a cvxopt "
+                                                        "fit, in n x n arrays of doubles", default=1.1)
+    parser.add_argument("--pi", type=float, nargs='+', help="priors of the warm start check", default=[1.0, 2.0, 3.0])
+    parser.add_argument("--max_drift", type=float, help="bound of the warm start check on the decision values",
+                        default=1e-2)
+    args = parser.parse_args()
+
+    if args.experiment == 'approx':
+        compare_approx(args.dataset, args)
+    elif args.experiment == 'sharded':
+        compare_sharded(args.dataset, args)
+    elif args.experiment == 'dtype':
+        compare_dtype(args.datasets, args)
+    elif args.experiment == 'penalty':
+        compare_penalty(args.dataset, args)
+    elif args.experiment == 'dedup':
+        compare_dedup(args.dataset, args)
+    elif args.experiment == 'screening':
+        compare_screening(args.dataset, args)
+    elif args.experiment == 'multiclass':
+        compare_multiclass(args.dataset, args)
+    elif args.experiment == 'memory':
+        check_memory(args.dataset, args)
+    elif args.experiment == 'warm_start':
+        check_warm_start(args.dataset, args)
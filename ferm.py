@@ -3,17 +3,30 @@ from sklearn import svm
 from sklearn.metrics import accuracy_score
 from measures import equalized_odds_measure_TP
 from sklearn.model_selection import GridSearchCV
-from cvxopt import matrix
 import numpy as np
 from numpy import linalg
-import cvxopt
-import cvxopt.solvers
-from sklearn.base import BaseEstimator
+from sklearn.base import BaseEstimator, clone
 from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.svm import LinearSVC
+from solvers import KernelRowCache, BlockedKernel, DenseRows, DualProblem, QP_BACKENDS, LOOSE_TOLERANCES, \
+    smo_solve, apg_solve, decomposition_solve, penalty_solve
+from screening import gap_safe_screen
+from group_means import group_indicator, group_kernel_means, group_feature_means
+from parallel import limit_threads
+import copy
+import functools
+import json
+import os
 import time
 from collections import namedtuple
 
 
+# Layout of the saved models, see FERM.save
+MODEL_FORMAT = 'ferm-model'
+MODEL_VERSION = 1
+
+
 # Definition of different kernels
 def linear_kernel(x1, x2):
     return np.dot(x1, np.transpose(x2))
@@ -21,145 +34,737 @@ def linear_kernel(x1, x2):
 def gaussian_kernel(x, y, gamma=0.1):
     return np.exp(-gamma * (linalg.norm(x - y)**2))
 
+def kernel_block(x1, x2, kernel='rbf', gamma=1.0, dtype=np.float64):
+    # the kernel block between x1 and x2 evaluated in dtype, a module function so that fitted models pickle
+    x1, x2 = np.asarray(x1, dtype), np.asarray(x2, dtype)
+    if kernel == 'rbf':
+        return rbf_kernel(x1, x2, gamma)
+    return linear_kernel(x1, x2)
+
 
 class FERM(BaseEstimator):
     # FERM algorithm
     def __init__(self, kernel='rbf', C=1.0, sensible_feature=None,
-                 gamma=1.0, prior=False, pi=1, constraint='EO', lamda=0.5):
+                 gamma=1.0, prior=False, pi=1, constraint='EO', lamda=0.5,
+                 solver='cvxopt', cache_size=200, kernel_approx=None, n_components=100, random_state=None,
+                 kernel_cache=None, predict_memory=64, block_size=1000, solver_options=None,
+                 working_set_size=200, incremental=False, dtype=np.float64, n_threads=None, tol_tier='full',
+                 fairness_mode='constraint', mu=1.0, dedup=False, screening=False,
+                 screening_tol=1e-4):
         self.kernel = kernel
         self.C = C
         self.fairness = False if sensible_feature is None else True
-        self.sensible_feature = sensible_feature
+        self.sensible_feature = sensible_feature  # the column index of the sensitive feature in X, or its values on
+        # the samples of fit, a CV fold needs the column index or the sensitive_features fit parameter, see _sensitive
         self.gamma = gamma
         self.w = None
         self.prior = prior  # added by hobo, whether to use prior knowledge
         self.pi = pi  # pi as the prior knowledge, is the ratio between two groups
         self.constraint = constraint  # whether to use EO or DP as constraint
         self.lamda = lamda
-
-    def fit(self, X, y):
+        self.solver = solver  # 'cvxopt' or 'admm' solve the dense QP (see QP_BACKENDS), 'smo' never builds the
+        # Gram matrix, 'blocked' never stores the Gram matrix either and solves by accelerated projected gradient
+        # over blocks of rows of K, 'decomposition' solves sub-QPs on working sets of the most violating
+        # multipliers, 'primal' solves the linear kernel in the d-dimensional primal
+        self.cache_size = cache_size  # size (MB) of the kernel row cache of the SMO and decomposition solvers
+        self.kernel_approx = kernel_approx  # None for the exact kernel, 'nystroem' or 'rff' for an explicit feature map
+        self.n_components = n_components  # dimension of the approximate feature map
+        self.random_state = random_state
+        self.kernel_cache = kernel_cache  # a KernelCache keeping the Gram matrices on disk across runs
+        self.predict_memory = predict_memory  # memory cap (MB) of the kernel block evaluated by each prediction chunk
+        self.block_size = block_size  # rows of K evaluated at once when the Gram matrix is not stored
+        self.solver_options = solver_options  # keyword options of the QP backend, e.g. {'tol': 1e-2} for 'admm'
+        self.working_set_size = working_set_size  # size of the sub-QPs of the decomposition solver
+        self.incremental = incremental  # keep the Gram matrix of the dense solvers for partial_fit
+        self.dtype = dtype  # precision of the kernel matrices, np.float32 halves the memory and bandwidth of the
+        # kernel rows and blocks of smo, blocked and decomposition and of prediction, the dense QP backends factor
+        # a double P formed in place over K, so their Gram matrix stays double (see _dense_kernel)
+        self.n_threads = n_threads  # BLAS threads of the fits, None leaves the thread pools unchanged,
+        # see parallel.split_cores to share the cores with parallel fits
+        self.tol_tier = tol_tier  # 'full' solves to the default tolerances of the solver, 'loose' stops early,
+        # enough to score the candidates of a grid search, see LOOSE_TOLERANCES and TwoTierGridSearchCV
+        self.fairness_mode = fairness_mode  # 'constraint' keeps the fairness rows as equalities, 'penalty' moves
+        # them into the objective as mu * (y tau)(y tau)^T, solved by coordinate descent with solver='smo'
+        self.mu = mu  # weight of the fairness penalty
+        self.dedup = dedup  # collapse the identical (x, y, group) training rows into one representative weighted
+        # by their number (their total sample weight), a smaller QP with the same solution
+        self.screening = screening  # drop the samples that a duality gap rule proves to be non support vectors
+        # before the dense QP, the rule starts from a cheaper SMO solve on K, see screening.gap_safe_screen
+        self.screening_tol = screening_tol  # tolerance of the SMO reference solution, the smaller its duality gap
+        # the more samples are screened
+
+    def _set_kernel(self):
+        # the kernel blocks are evaluated and returned in self.dtype
+        self.fkernel = functools.partial(kernel_block, kernel=self.kernel, gamma=self.gamma, dtype=self.dtype)
+
+    def _reset_stats(self):
+        # fit_stats_ records where the time of a fit goes: the wall time of each phase, the state of the
+        # solver at exit, the number of support vectors and the bytes of the largest arrays held at once,
+        # the matrix-free solvers evaluate the kernel within the solve
+        self.fit_stats_ = {'kernel_time': 0.0, 'group_time': 0.0, 'screening_time': 0.0, 'assembly_time': 0.0,
+                           'solve_time': 0.0, 'intercept_time': 0.0, 'iterations': None, 'primal_infeasibility': None,
+                           'dual_infeasibility': None, 'status': None, 'n_sv': None, 'peak_bytes': 0,
+                           'tol_tier': self.tol_tier, 'n_samples': None, 'n_screened': None}
+
+    def _tolerances(self, solver):
+        # the tolerance options of the solver in the tier tol_tier
+        if self.tol_tier == 'full':
+            return {}
+        elif self.tol_tier == 'loose':
+            return dict(LOOSE_TOLERANCES[solver])
+        raise ValueError('tol_tier should be full or loose, got {}'.format(self.tol_tier))
+
+    def _timed(self, phase, start):
+        # add the time since start to the phase of fit_stats_, return the current time
+        now = time.perf_counter()
+        self.fit_stats_[phase + '_time'] += now - start
+        return now
+
+    def _track_bytes(self, *arrays):
+        nbytes = sum(array.nbytes for array in arrays if array is not None)
+        self.fit_stats_['peak_bytes'] = max(self.fit_stats_['peak_bytes'], int(nbytes))
+
+    def _solver_stats(self, solution):
+        self.fit_stats_.update({'iterations': solution.get('iterations'), 'status': solution.get('status'),
+                                'primal_infeasibility': solution.get('primal infeasibility'),
+                                'dual_infeasibility': solution.get('dual infeasibility')})
+
+    def _prior_weight(self, i=1):
+        # the combination between \pi and 1, (1-\lambda) * \pi + \lambda, weighting the mean of the first group
+        if not self.prior:
+            return 1.0
+        pi = self.pi[i - 1] if isinstance(self.pi, list) else self.pi
+        return (1 - self.lamda) * pi + self.lamda
+
+    def _upper_bound(self):
+        # the upper bound of the multipliers, C * sample_weight when the samples are weighted
+        if self.C is None or self.sample_weight_ is None:
+            return self.C
+        return self.C * self.sample_weight_
+
+    def _kernel_diag(self, X):
         if self.kernel == 'rbf':
-            self.fkernel = lambda x, y: rbf_kernel(x, y, self.gamma)
-        elif self.kernel == 'linear':
-            self.fkernel = linear_kernel
+            return np.ones(len(X))
+        return np.einsum('ij,ij->i', X, X)
+
+    def _fairness_rows(self, X, y, K=None, means=None):
+        # tau_i = mean of group i - ((1-\lambda) * \pi + \lambda) * mean of the first group, evaluated at every
+        # sample, where the group means are the kernel mean embeddings of the groups
+        start = time.perf_counter()
+        if means is None:
+            means = group_kernel_means(self.fkernel, X, self.group_indicator, K, self.block_size)
+        self.group_means = means
+        self.tau_list = [means[i] - self._prior_weight(i) * means[0] for i in range(1, len(means))]
+        fairness_rows = y * np.array(self.tau_list)
+        self._track_bytes(K, means, fairness_rows)
+        self._timed('group', start)
+        return fairness_rows
+
+    def _fit_approx(self, X, y):
+        # map X into an explicit feature space z(x) approximating the kernel and solve the fair problem
+        # there as a linear primal, O(n * n_components) memory instead of O(n^2)
+        if self.kernel_approx == 'nystroem':
+            self.feature_map = Nystroem(kernel=self.kernel, gamma=self.gamma,
+                                        n_components=self.n_components, random_state=self.random_state)
+        elif self.kernel_approx == 'rff' and self.kernel == 'rbf':
+            self.feature_map = RBFSampler(gamma=self.gamma, n_components=self.n_components,
+                                          random_state=self.random_state)
         else:
-            self.fkernel = linear_kernel
-
+            raise ValueError('kernel_approx should be nystroem or rff (rbf kernel only), got {}'
+                             .format(self.kernel_approx))
+        start = time.perf_counter()
+        Z = self.feature_map.fit_transform(X)
+        self._timed('kernel', start)
+        self._fit_primal(Z, y)
+
+    def _fit_primal(self, Z, y):
+        # solve the fair problem as a linear primal on the explicit features Z (X itself for the linear kernel)
+        if self.C is None:
+            raise ValueError('the primal solver needs a finite C')
+
+        start = time.perf_counter()
         if self.fairness:
-            self.values_of_sensible_feature = list(set(self.sensible_feature))
-            self.list_of_sensible_feature_train = self.sensible_feature
-            self.val0 = np.min(self.values_of_sensible_feature)
-            self.val1 = np.max(self.values_of_sensible_feature)
-            self.set_A1 = [idx for idx, ex in enumerate(X) if y[idx] == 1
-                           and self.sensible_feature[idx] == self.val1]
-            self.set_not_A1 = [idx for idx, ex in enumerate(X) if y[idx] == 1
-                               and self.sensible_feature[idx] == self.val0]
-            # print('self.val0:', self.val0)
-            # print('self.val1:', self.val1)
-            # print('(y, self.sensible_feature):')
-            # for el in zip(y, self.sensible_feature):
-            #     print(el)
-            self.set_1 = [idx for idx, ex in enumerate(X) if y[idx] == 1]
-            self.n_A1 = len(self.set_A1)
-            self.n_not_A1 = len(self.set_not_A1)
-            self.n_1 = len(self.set_1)
+            # the fairness constraint on the group feature means, u_i^T w = 0 with
+            # u_i = mean of group i - ((1-\lambda) * \pi + \lambda) * mean of the first group
+            means = group_feature_means(Z, self.group_indicator)
+            self.u_list = [means[i] - self._prior_weight(i) * means[0] for i in range(1, len(means))]
+            start = self._timed('group', start)
+            # as in Linear_FERM, a new representation where U w = 0 holds for every linear model:
+            # Z is projected on the null space of U
+            U = np.array(self.u_list)
+            Z_projected = Z - Z.dot(np.linalg.pinv(U)).dot(U)
+            self._track_bytes(Z, Z_projected)
+            Z = Z_projected
+            start = self._timed('assembly', start)
+        self._track_bytes(Z)
+
+        model = LinearSVC(C=self.C, loss='hinge', random_state=self.random_state, max_iter=10000,
+                          **self._tolerances('primal'))
+        model.fit(Z, y, sample_weight=self.sample_weight_)
+        self.w = model.coef_.ravel()
+        self.b = model.intercept_[0]
+        self._timed('solve', start)
+        self._solver_stats({'iterations': int(model.n_iter_),
+                            'status': 'optimal' if model.n_iter_ < model.max_iter else 'unknown'})
+
+    def _penalized(self):
+        # whether the fairness rows are a penalty of the objective rather than constraints
+        if self.fairness_mode == 'constraint':
+            return False
+        elif self.fairness_mode != 'penalty':
+            raise ValueError('fairness_mode should be constraint or penalty, got {}'.format(self.fairness_mode))
+        elif self.kernel_approx is not None or self.solver not in ('smo',) + tuple(QP_BACKENDS):
+            raise ValueError('the fairness penalty is solved by smo or one of {}'.format(sorted(QP_BACKENDS)))
+        return self.fairness
+
+    def _fit_dual(self, X, y, group_means=None):
+        # group_means, the kernel means of the groups at every sample of X, are computed here if None
+        self._penalized()  # check the fairness mode before any kernel evaluation
+        if self.kernel_approx is not None or self.solver == 'primal':
+            self.X_train, self.y_train = X, y  # partial_fit refits them on the enlarged training set
+        if self.kernel_approx is not None:
+            self._fit_approx(X, y)
+        elif self.solver == 'primal':  # d-dimensional primal, training and prediction do not depend on n^2
+            if self.kernel != 'linear':
+                raise ValueError('the primal solver needs the linear kernel, use kernel_approx for the rbf kernel')
+            self._fit_primal(X, y)
+        elif self.solver in ('smo', 'blocked', 'decomposition'):  # the Gram matrix is never built
+            fairness_rows = self._fairness_rows(X, y, means=group_means) if self.fairness else None
+            self._fit_iterative(X, y, fairness_rows)
+        elif self.solver in QP_BACKENDS:
+            # Gram matrix
+            K, _ = self._gram(X)
+            fairness_rows = self._fairness_rows(X, y, K, group_means) if self.fairness else None
+            self._fit_qp(X, y, K, fairness_rows)
+            self.gram = K if self.incremental else None
+        else:
+            raise ValueError('unknown solver {}, use smo, blocked, decomposition, primal or one of {}'
+                             .format(self.solver, sorted(QP_BACKENDS)))
+
+    def _gram(self, X):
+        # the Gram matrix of the dense QP, or the matrix-free access to K of the iterative solvers
+        start = time.perf_counter()
+        K, kernel = None, None
+        # the row and block evaluations work on a single cast of X
+        X_kernel = np.asarray(X, dtype=self.dtype)
+        if self.solver in ('smo', 'decomposition'):
+            kernel = KernelRowCache(self.fkernel, X_kernel, self.cache_size, self.dtype)
+        elif self.solver == 'blocked':
+            kernel = BlockedKernel(self.fkernel, X_kernel, self.block_size, self.dtype)
+        elif self.kernel_cache is not None:
+            K = np.asarray(self.kernel_cache.gram(X, X, self.kernel, self.gamma), dtype=np.double)
+        else:
+            K = self._dense_kernel(X)
+        self._track_bytes(K)
+        self._timed('kernel', start)
+        return K, kernel
+
+    def _dense_kernel(self, X, out=None):
+        # the Gram matrix filled by blocks of rows, into out if given (e.g. a memory-mapped file), the kernel
+        # evaluation of a block holds a few temporaries of its size, so the blocks are capped at n / 64 rows to
+        # keep them within ~5% of K. The dense QP backends factor P = (y y^T) * K in double and form it in place
+        # over K, so their own K is double whatever the dtype: a single precision K would be kept next to a
+        # double copy of P. An out given by the caller (the read-only K shared by MulticlassPFERM) keeps its dtype
+        K = np.empty((len(X), len(X)), dtype=np.double) if out is None else out
+        fkernel = functools.partial(kernel_block, kernel=self.kernel, gamma=self.gamma, dtype=K.dtype)
+        rows = min(self.block_size, max(1, len(X) // 64))
+        for start, end, K_block in BlockedKernel(fkernel, X, rows, K.dtype).blocks():
+            K[start:end] = K_block
+        return K
+
+    def _set_coefficients(self):
+        # the precombined coefficients a_n * y_n of the support vectors, and w = sum_n a_n y_n x_n for the
+        # linear kernel so that project costs O(d) per sample
+        self.a_sv_y = self.a * self.sv_y
+        if self.kernel == 'linear':
+            self.w = np.dot(self.a_sv_y, self.sv)
+        else:
+            self.w = None
 
-        n_samples, n_features = X.shape
-
-        # Gram matrix
-        K = self.fkernel(X, X)
-
-        P = cvxopt.matrix(np.outer(y, y) * K)
-        q = cvxopt.matrix(np.ones(n_samples) * -1)
-        # print(y)
-        A = cvxopt.matrix(y.astype(np.double), (1, n_samples), 'd')
-        b = cvxopt.matrix(0.0)
-
-        if self.C is None:  # \alpha should be larger than 0
-            G = cvxopt.matrix(np.diag(np.ones(n_samples) * -1))
-            h = cvxopt.matrix(np.zeros(n_samples))
-        else:  # \alpha should be between 0 and C
-            tmp1 = np.diag(np.ones(n_samples) * -1)
-            tmp2 = np.identity(n_samples)
-            G = cvxopt.matrix(np.vstack((tmp1, tmp2)))
-            tmp1 = np.zeros(n_samples)
-            tmp2 = np.ones(n_samples) * self.C
-            h = cvxopt.matrix(np.hstack((tmp1, tmp2)))
-
-        # Stack the fairness constraint
-        if self.fairness:
-            if self.prior: # prior knowledge that the probability of female getting AD is twice that of male
-                if isinstance(self.pi, list):
-                    # tau = [(np.sum(K[self.set_A1, idx]) / self.n_A1) -
-                    #        self.pi[0] * (np.sum(K[self.set_not_A1, idx]) / self.n_not_A1)
-                    #        for idx in range(len(y))]
-
-                    # we do the combination between \pi and 1, (1-\lambda) * \pi + \lambda
-                    tau = [(np.sum(K[self.set_A1, idx]) / self.n_A1) -
-                           ((1 - self.lamda) * self.pi[0] + self.lamda) * (np.sum(K[self.set_not_A1, idx]) / self.n_not_A1)
-                           for idx in range(len(y))]
-                else:
-                    # tau = [(np.sum(K[self.set_A1, idx]) / self.n_A1) -
-                    #        self.pi * (np.sum(K[self.set_not_A1, idx]) / self.n_not_A1)
-                    #        for idx in range(len(y))]
-
-                    # we do the combination between \pi and 1, (1-\lambda) * \pi + \lambda
-                    tau = [(np.sum(K[self.set_A1, idx]) / self.n_A1) -
-                           ((1 - self.lamda) * self.pi + self.lamda) * (np.sum(K[self.set_not_A1, idx]) / self.n_not_A1)
-                           for idx in range(len(y))]
-            else:
-                tau = [(np.sum(K[self.set_A1, idx]) / self.n_A1) -
-                       (np.sum(K[self.set_not_A1, idx]) / self.n_not_A1)
-                       for idx in range(len(y))]
-            # print('self.n_A1:', self.n_A1)
-            # print('self.n_not_A1:', self.n_not_A1)
-            # print('tau:', tau)
-            fairness_line = matrix(y * tau, (1, n_samples), 'd')
-            A = cvxopt.matrix(np.vstack([A, fairness_line]))
-            b = cvxopt.matrix([0.0, 0.0])
-
-        # solve QP problem
-        cvxopt.solvers.options['show_progress'] = False
-        # print('A:', A)
-        # print('Rank(A):', np.linalg.matrix_rank(A))
-        # print('Rank([P; A; G])', np.linalg.matrix_rank(np.vstack([P, A, G])))
-        solution = cvxopt.solvers.qp(P, q, G, h, A, b)
+    def _fit_iterative(self, X, y, fairness_rows=None, kernel=None, init=None):
+        # the SMO, blocked or decomposition solver, kernel is the KernelRowCache or the BlockedKernel given by _gram
+        if kernel is None:
+            _, kernel = self._gram(X)
+        start = time.perf_counter()
+        tolerances = self._tolerances(self.solver)
+        if self._penalized():
+            tolerances.pop('feas_tol', None)  # the penalty form has no feasibility to reach
+            solution = penalty_solve(kernel, self._kernel_diag(X), y, self._upper_bound(), fairness_rows, self.mu, init=init,
+                                     **tolerances)
+        elif self.solver == 'smo':
+            solution = smo_solve(kernel, self._kernel_diag(X), y, self._upper_bound(), fairness_rows, init=init,
+                                 **tolerances)
+        elif self.solver == 'decomposition':
+            solution = decomposition_solve(kernel, y, self._upper_bound(), fairness_rows, self.working_set_size, init=init,
+                                           **tolerances)
+        else:
+            solution = apg_solve(kernel, y, self._upper_bound(), fairness_rows, init=init, **tolerances)
+        start = self._timed('solve', start)
+        self._track_bytes(kernel, fairness_rows)
+
+        # Lagrange multipliers
+        a = solution['x']
+        self._keep_training_state(X, y, {key: solution[key] for key in ('x', 'Qa', 'nu')})
+
+        # Support vectors have non zero lagrange multipliers
+        sv = a > 1e-7
+        self.sv_index = np.flatnonzero(sv)
+        self.a = a[sv]
+        self.sv = X[sv]
+        self.sv_y = y[sv]
+
+        # Intercept, the solver keeps (Q a)_n = y_n * sum_m a_m y_m K[n, m], a weighted sample counts as
+        # sample_weight copies of itself
+        self.b = np.average(self.sv_y - self.sv_y * solution['Qa'][sv],
+                            weights=None if self.sample_weight_ is None else self.sample_weight_[sv])
+        self._set_coefficients()
+        self._timed('intercept', start)
+        self._solver_stats(solution)
+        self.fit_stats_['n_sv'] = len(self.a)
+        return solution
+
+    def _screen(self, K, y, fairness_rows=None):
+        # the samples left in the QP by the gap safe screening, None when no sample is screened
+        if self.C is None or self._penalized():
+            raise ValueError('screening needs a finite C and fairness_mode constraint')
+        start = time.perf_counter()
+        upper_bound = self._upper_bound()
+        reference = smo_solve(DenseRows(K), np.diagonal(K), y, upper_bound, fairness_rows, tol=self.screening_tol)
+        screened = gap_safe_screen(K, y, upper_bound, fairness_rows, reference['x'])
+        self.fit_stats_['n_screened'] = int(np.sum(screened))
+        self._timed('screening', start)
+        return np.flatnonzero(~screened) if np.any(screened) else None
+
+    def _fit_qp(self, X, y, K, fairness_rows=None, workspace=None, init=None):
+        # solve QP problem, \alpha should be between 0 and C (larger than 0 if C is None), by the backend
+        # self.solver, workspace and init let the backend reuse its factorization and the previous solution
+        kept = self._screen(K, y, fairness_rows) if self.screening else None
+        start = time.perf_counter()
+        K_qp, y_qp, rows, upper_bound = K, y, fairness_rows, self._upper_bound()
+        if kept is not None:
+            # the QP of the samples left by the screening, the fairness rows keep the group means of all the
+            # samples, the screened multipliers are zero
+            K_qp, y_qp = K[np.ix_(kept, kept)], y[kept]
+            rows = None if fairness_rows is None else fairness_rows[:, kept]
+            upper_bound = upper_bound[kept] if np.ndim(upper_bound) else upper_bound
+            init = None if init is None else {'x': init['x'][kept]}
+            workspace = None
+        # P is formed in place over K and turned back into K after the solve, K is needed by the intercept
+        if self._penalized():
+            problem = DualProblem(K_qp, y_qp, None, upper_bound, overwrite_K=True, penalty_rows=rows, mu=self.mu)
+        else:
+            problem = DualProblem(K_qp, y_qp, rows, upper_bound, overwrite_K=True)
+        start = self._timed('assembly', start)
+        options = dict(self._tolerances(self.solver), **(self.solver_options or {}))
+        if kept is not None and self.solver == 'cvxopt':
+            # the interior point stops on the duality gap summed over the box rows, the tolerances are scaled by
+            # the share of kept samples so that each multiplier is solved as accurately as in the whole QP
+            for key, default in (('abstol', 1e-7), ('reltol', 1e-6)):
+                options[key] = options.get(key, default) * len(kept) / len(y)
+        solution = QP_BACKENDS[self.solver](problem, init, workspace, **options)
+        start = self._timed('solve', start)
+        # the backends build their n x n matrix from the problem, that time is part of the assembly
+        self.fit_stats_['assembly_time'] += solution.get('assembly time', 0.0)
+        self.fit_stats_['solve_time'] -= solution.get('assembly time', 0.0)
+        K_bytes = K.nbytes + (K_qp.nbytes if kept is not None else 0)
+        self.fit_stats_['peak_bytes'] = max(self.fit_stats_['peak_bytes'],
+                                            K_bytes + problem.A.nbytes + solution.get('workspace bytes', 0))
 
         # Lagrange multipliers
-        a = np.ravel(solution['x'])
+        if kept is not None:
+            a = np.zeros(len(y))
+            a[kept] = solution['x']
+            solution = dict({key: value for key, value in solution.items() if not isinstance(value, np.ndarray)},
+                            x=a)
+            # the iterates of the backend live on the kept samples, only the multipliers are a warm start
+            self._keep_training_state(X, y, {'x': a})
+        else:
+            a = solution['x']
+            # the backend's own iterates (e.g. z and y of admm) are kept as its warm start
+            self._keep_training_state(X, y, {key: value for key, value in solution.items()
+                                             if isinstance(value, np.ndarray)})
 
         # Support vectors have non zero lagrange multipliers
         sv = a > 1e-7
         ind = np.arange(len(a))[sv]
+        self.sv_index = ind
         self.a = a[sv]
         self.sv = X[sv]
         self.sv_y = y[sv]
-        # print("%d support vectors out of %d points" % (len(self.a), n_samples))
+        # print("%d support vectors out of %d points" % (len(self.a), len(X)))
 
-        # Intercept
+        # Intercept, a weighted sample counts as sample_weight copies of itself
+        weights = np.ones(len(self.a)) if self.sample_weight_ is None else self.sample_weight_[sv]
         self.b = 0
         for n in range(len(self.a)):
-            self.b += self.sv_y[n]
-            self.b -= np.sum(self.a * self.sv_y * K[ind[n], sv])
-        self.b /= len(self.a)
-
-        # Weight vector
-        if self.kernel == linear_kernel:
-            self.w = np.zeros(n_features)
-            for n in range(len(self.a)):
-                self.w += self.a[n] * self.sv_y[n] * self.sv[n]
+            self.b += weights[n] * (self.sv_y[n] - np.sum(self.a * self.sv_y * K[ind[n], sv]))
+        self.b /= np.sum(weights)
+
+        self._set_coefficients()
+        self._timed('intercept', start)
+        self._solver_stats(solution)
+        self.fit_stats_['n_sv'] = len(self.a)
+        return solution
+
+    def _keep_training_state(self, X, y, dual_solution):
+        # what partial_fit needs to extend the fit: the training set and the full dual solution
+        self.X_train = X
+        self.y_train = y
+        self.dual_solution = dual_solution
+
+    def _group_values(self):
+        return [self.val0, self.val1]
+
+    @limit_threads
+    def partial_fit(self, X_new, y_new, s_new=None):
+        '''
+        Add new samples to a fitted model. Only the kernel rows of the new samples are evaluated: they extend
+        the Gram matrix kept by incremental=True (dense solvers) and update the sums of the group kernel means
+        in O(n * m), and the dual is warm started from the previous multipliers (zero for the new samples),
+        which still satisfy the box and the balance row. The model is refitted from scratch when it was not
+        fitted by a dual solver or when the new samples bring a new value of the sensitive feature.
+        :param X_new: the m new samples.
+        :param y_new: their labels.
+        :param s_new: their sensitive feature, needed by the fairness constraint unless sensible_feature is
+        a column index of X.
+        The new samples have unit weight, and they are not collapsed with the training rows by dedup.
+        '''
+        X_new, y_new = np.asarray(X_new), np.asarray(y_new)
+        if s_new is None and self.sensible_feature is not None and np.ndim(self.sensible_feature) == 0:
+            s_new = X_new[:, int(self.sensible_feature)]
+        if not hasattr(self, 'X_train'):
+            self.fit(X_new, y_new, s_new)
+            return self
+        if self.fairness and s_new is None:
+            raise ValueError('the sensitive feature of the new samples is needed')
+
+        X_old, y_old, n = self.X_train, self.y_train, len(self.X_train)
+        X, y = np.vstack([X_old, X_new]), np.concatenate([y_old, y_new])
+        sensitive = np.concatenate([self.sensitive_, s_new]) if self.fairness else None
+        sample_weight = None if self.sample_weight_ is None \
+            else np.concatenate([self.sample_weight_, np.ones(len(X_new))])
+        if self.kernel_approx is not None or self.solver == 'primal':
+            self.fit(X, y, sensitive, sample_weight)
+            return self
+
+        self._reset_stats()
+        start = time.perf_counter()
+        # the only kernel evaluations, m x (n + m), in double for the Gram matrix of the dense backends
+        K_new = kernel_block(X_new, X, self.kernel, self.gamma, np.double if self.solver in QP_BACKENDS else self.dtype)
+        self._track_bytes(K_new)
+        start = self._timed('kernel', start)
+
+        fairness_rows = None
+        if self.fairness:
+            old_values, old_indicator, old_means = self._group_values(), self.group_indicator, self.group_means
+            self._prepare_fit(X, y, sensitive, sample_weight)
+            if list(self._group_values()) != list(old_values):
+                self.fit(X, y, sensitive, sample_weight)
+                return self
+            # the sums over the old members gain the columns of the new samples, then the new members are added
+            counts = np.sum(old_indicator, axis=1, keepdims=True)
+            sums = np.hstack([old_means * counts, old_indicator.dot(K_new[:, :n].T)])
+            sums += self.group_indicator[:, n:].dot(K_new)
+            means = sums / np.sum(self.group_indicator, axis=1, keepdims=True)
+            self._timed('group', start)
+            fairness_rows = self._fairness_rows(X, y, means=means)
         else:
-            self.w = None
+            self._set_kernel()
+            self.sample_weight_ = sample_weight
+
+        # warm start, the new multipliers are zero
+        previous, m = self.dual_solution, len(X_new)
+        init = {'x': np.concatenate([previous['x'], np.zeros(m)])}
+        if 'Qa' in previous:  # (Q a)_i = y_i * sum_j a_j y_j K[i, j] of the new samples
+            init['Qa'] = np.concatenate([previous['Qa'], y_new * K_new[:, :n].dot(previous['x'] * y_old)])
+            init['nu'] = previous['nu']
+        if 'z' in previous:  # admm, the box rows of the new samples are inactive
+            init['z'] = np.concatenate([previous['z'][:n], np.zeros(m), previous['z'][n:]])
+            init['y'] = np.concatenate([previous['y'][:n], np.zeros(m), previous['y'][n:]])
+
+        if self.solver in QP_BACKENDS:
+            start = time.perf_counter()
+            if self.gram is not None:
+                K = np.empty((n + m, n + m), dtype=K_new.dtype)
+                K[:n, :n] = self.gram
+                K[n:] = K_new
+                K[:n, n:] = K_new[:, :n].T
+            else:
+                K = self._dense_kernel(X)
+            self._track_bytes(K)
+            self._timed('kernel', start)
+            self._fit_qp(X, y, K, fairness_rows, init=init)
+            self.gram = K if self.incremental else None
+        else:
+            _, kernel = self._gram(X)
+            self._fit_iterative(X, y, fairness_rows, kernel, init)
+        return self
+
+    def _sensitive(self, X, sensitive_features=None):
+        # the sensitive feature of the samples of X: the fit parameter sensitive_features, which the CV
+        # machinery slices with X, else the column sensible_feature of X, else the array sensible_feature,
+        # which must hold the values of exactly these samples, None without fairness constraint
+        if sensitive_features is not None:
+            sensitive = np.asarray(sensitive_features)
+        elif self.sensible_feature is None:
+            return None
+        elif np.ndim(self.sensible_feature) == 0:
+            sensitive = np.asarray(X)[:, int(self.sensible_feature)]
+        else:
+            sensitive = np.asarray(self.sensible_feature)
+            if len(sensitive) != len(X):
+                raise ValueError('sensible_feature has {} values for {} samples, the rows of a CV fold cannot be '
+                                 'matched with them: pass the column index of the sensitive feature in X or '
+                                 'fit(X, y, sensitive_features=...)'.format(len(sensitive), len(X)))
+        if len(sensitive) != len(X):
+            raise ValueError('the sensitive feature has {} values for {} samples'.format(len(sensitive), len(X)))
+        return sensitive
+
+    def _sample_weight(self, X, sample_weight=None):
+        # the weights of the samples of X as a double array, None when the samples are not weighted
+        if sample_weight is None:
+            return None
+        sample_weight = np.asarray(sample_weight, dtype=np.double)
+        if sample_weight.shape != (len(X),):
+            raise ValueError('sample_weight has {} values for {} samples'.format(len(sample_weight), len(X)))
+        if np.any(sample_weight < 0):
+            raise ValueError('sample_weight should be nonnegative')
+        return sample_weight
+
+    def _collapse_duplicates(self, X, y, sensitive_features=None, sample_weight=None):
+        # with dedup, the identical (x, y, group) rows become their first occurrence weighted by their total
+        # weight: the bound C * w and the weighted group means make it the same dual as the repeated rows
+        X, y = np.asarray(X), np.asarray(y)
+        sample_weight = self._sample_weight(X, sample_weight)
+        if not self.dedup:
+            return X, y, sensitive_features, sample_weight
+        sensitive = self._sensitive(X, sensitive_features)
+        rows = np.column_stack([X, y] if sensitive is None else [X, y, sensitive])
+        _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        if len(first) == len(X):
+            return X, y, sensitive_features, sample_weight
+        # the representatives keep the order of the training set
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=int)
+        rank[order] = np.arange(len(order))
+        weight = np.bincount(rank[np.ravel(inverse)], weights=sample_weight, minlength=len(order))
+        kept = first[order]
+        return X[kept], y[kept], None if sensitive is None else sensitive[kept], weight
+
+    def _prepare_fit(self, X, y, sensitive_features=None, sample_weight=None):
+        self._set_kernel()
+        self.sensitive_ = self._sensitive(X, sensitive_features)
+        self.fairness = self.sensitive_ is not None
+        self.sample_weight_ = self._sample_weight(X, sample_weight)
+        self.fit_stats_['n_samples'] = len(X)
+
+        if self.fairness:
+            self.values_of_sensible_feature = list(set(self.sensitive_))
+            self.list_of_sensible_feature_train = self.sensitive_
+            self.val0 = np.min(self.values_of_sensible_feature)
+            self.val1 = np.max(self.values_of_sensible_feature)
+            # indicator of the positive instances of the two groups, the group of val0 comes first
+            self.group_indicator = group_indicator(self.sensitive_, y, [self.val0, self.val1], self.sample_weight_)
+            self.set_not_A1, self.set_A1 = [np.flatnonzero(ind) for ind in self.group_indicator]
+            self.set_1 = np.flatnonzero(y == 1)
+            self.n_A1 = len(self.set_A1)
+            self.n_not_A1 = len(self.set_not_A1)
+            self.n_1 = len(self.set_1)
+
+    @limit_threads
+    def fit(self, X, y, sensitive_features=None, sample_weight=None):
+        '''
+        :param X: the training samples.
+        :param y: the labels, in {-1, 1}.
+        :param sensitive_features: the sensitive feature of the samples of X, it overrides sensible_feature.
+        As a sample-aligned fit parameter, GridSearchCV(...).fit(X, y, sensitive_features=s) slices it with
+        every fold and its workers never receive the whole array.
+        :param sample_weight: the weight of every sample, a sample of weight w counts as w copies of itself:
+        its multiplier is bounded by C * w and it weighs w in the group means of the fairness rows.
+        '''
+        self._reset_stats()
+        start = time.perf_counter()
+        X, y, sensitive_features, sample_weight = self._collapse_duplicates(X, y, sensitive_features, sample_weight)
+        self._prepare_fit(X, y, sensitive_features, sample_weight)
+        self._timed('group', start)
+        self._fit_dual(X, y)
+        return self
+
+    @limit_threads
+    def fit_subset(self, X, y, index, sensitive_features=None):
+        '''
+        Fit on the samples X[index] with the fairness rows of the groups of the whole X, e.g. on the merged
+        support vectors of ShardedPFERM, whose groups alone are biased toward the margin. The kernel means of
+        the groups of X are evaluated at the samples of the subset only, by blocks of group members, so the
+        means cost O(n * len(index)) kernel evaluations and the subset is then solved as by fit.
+        :param index: the indices of the samples of the subset in X.
+        :param sensitive_features: the sensitive feature of the samples of X, see fit.
+        '''
+        if self.kernel_approx is not None or self.solver == 'primal':
+            raise ValueError('fit_subset needs a dual solver, the group means are kernel means')
+        X, y = np.asarray(X), np.asarray(y)
+        self._reset_stats()
+        start = time.perf_counter()
+        self._prepare_fit(X, y, sensitive_features)
+        means, sensitive = None, None
+        if self.fairness:
+            values, sensitive = list(self._group_values()), self.sensitive_[index]
+            means = group_kernel_means(self.fkernel, X, self.group_indicator, block_size=self.block_size,
+                                       at=X[index])
+        self._prepare_fit(X[index], y[index], sensitive)
+        if self.fairness and list(self._group_values()) != values:
+            raise ValueError('every group of X needs a sample in the subset')
+        self._timed('group', start)
+        self._fit_dual(X[index], y[index], means)
+        return self
+
+    @limit_threads
+    def fit_precomputed(self, X, y, K, group_means=None, sensitive_features=None):
+        '''
+        Fit with a dense QP backend on the precomputed Gram matrix K of X, e.g. shared by the subproblems of
+        MulticlassPFERM. A read-only (memory-mapped) K is never written, P is then a copy.
+        :param K: the Gram matrix of X.
+        :param group_means: the kernel means of the groups of the fairness constraint at every sample of X, in
+        the order of the values of the sensitive feature, computed from K if None.
+        '''
+        if self.solver not in QP_BACKENDS or self.kernel_approx is not None:
+            raise ValueError('a precomputed Gram matrix is solved by one of {}'.format(sorted(QP_BACKENDS)))
+        self._reset_stats()
+        start = time.perf_counter()
+        self._prepare_fit(X, y, sensitive_features)
+        self._timed('group', start)
+        self._penalized()
+        fairness_rows = self._fairness_rows(X, y, K, group_means) if self.fairness else None
+        self._fit_qp(X, y, K, fairness_rows)
+        self.gram = None
+        return self
+
+    @limit_threads
+    def fit_path(self, X, y, Cs, sensitive_features=None, sample_weight=None):
+        # fit one model for every C in Cs: the kernel and the fairness rows are computed once and the
+        # models are solved for increasing C, each iterative solve warm started from the previous multipliers
+        # (they stay feasible since the box only grows), the models are returned in the order of Cs
+        if self.kernel_approx is not None or self.solver == 'primal':
+            models = [clone(self).set_params(C=C) for C in Cs]
+            for model in models:
+                model.fit(X, y, sensitive_features, sample_weight)
+            return models
+
+        # the shared phases (kernel, group means) are reported in the fit_stats_ of every model
+        self._reset_stats()
+        start = time.perf_counter()
+        X, y, sensitive_features, sample_weight = self._collapse_duplicates(X, y, sensitive_features, sample_weight)
+        self._prepare_fit(X, y, sensitive_features, sample_weight)
+        self._timed('group', start)
+        K, cache = self._gram(X)
+        self.gram = K if self.incremental else None  # shared by the models, for their partial_fit
+        fairness_rows = self._fairness_rows(X, y, K) if self.fairness else None
+
+        models, solution, last_C, workspace = {}, None, None, {}
+        for C in sorted(set(Cs), key=lambda C: np.inf if C is None else C):
+            model = copy.copy(self)
+            model.C = C
+            model.fit_stats_ = dict(self.fit_stats_)
+            if cache is not None:
+                if solution is not None and C is not None:
+                    # alpha seeding, the previous multipliers scaled to the new box still satisfy
+                    # the balance and the fairness rows
+                    solution = dict(solution, x=solution['x'] * C / last_C, Qa=solution['Qa'] * C / last_C)
+                solution = model._fit_iterative(X, y, fairness_rows, cache, solution)
+            else:
+                solution = model._fit_qp(X, y, K, fairness_rows, workspace, solution)
+            models[C] = model
+            last_C = C
+        return [models[C] for C in Cs]
+
+    @limit_threads
+    def fit_sweep(self, X, y, priors, sensitive_features=None, sample_weight=None):
+        # fit one model for every (pi, lamda) in priors: they only change the weight (1-\lambda) * \pi + \lambda
+        # of the first group's mean in the fairness rows, so the kernel and the group means are computed once
+        # and each iterative solve is warm started from the solution of the previous pair, neighbouring pairs
+        # (e.g. increasing pi) make the cheapest corrections
+        if self.kernel_approx is not None or self.solver == 'primal':
+            models = [clone(self).set_params(prior=True, pi=pi, lamda=lamda) for pi, lamda in priors]
+            for model in models:
+                model.fit(X, y, sensitive_features, sample_weight)
+            return models
+
+        self._reset_stats()
+        start = time.perf_counter()
+        X, y, sensitive_features, sample_weight = self._collapse_duplicates(X, y, sensitive_features, sample_weight)
+        self._prepare_fit(X, y, sensitive_features, sample_weight)
+        self._timed('group', start)
+        K, cache = self._gram(X)
+        self.gram = K if self.incremental else None  # shared by the models, for their partial_fit
+        start = time.perf_counter()
+        means = group_kernel_means(self.fkernel, X, self.group_indicator, K, self.block_size) \
+            if self.fairness else None
+        self._timed('group', start)
+
+        models, solution = [], None
+        for pi, lamda in priors:
+            model = copy.copy(self)
+            model.prior, model.pi, model.lamda = True, pi, lamda
+            model.fit_stats_ = dict(self.fit_stats_)
+            fairness_rows = model._fairness_rows(X, y, means=means) if self.fairness else None
+            if cache is not None:
+                solution = model._fit_iterative(X, y, fairness_rows, cache, solution)
+            else:
+                solution = model._fit_qp(X, y, K, fairness_rows, init=solution)
+            models.append(model)
+        return models
+
+    def _batched(self, f, X, width, itemsize=8):
+        # apply f to chunks of rows of X, where each chunk materializes at most predict_memory MB
+        # of an intermediate array with width columns of itemsize bytes
+        y_predict = np.empty(len(X))
+        batch = max(1, int(self.predict_memory * 2 ** 20 // (itemsize * max(width, 1))))
+        for start in range(0, len(X), batch):
+            y_predict[start:start + batch] = f(X[start:start + batch])
+        return y_predict
 
     def project(self, X):
-        if self.w is not None:
+        # not wrapped by limit_threads, so that scoring a few rows stays in microseconds: the thread pools of a
+        # prediction are the caller's
+        if self.kernel_approx is not None:
+            return self._batched(lambda x: np.dot(self.feature_map.transform(x), self.w),
+                                 X, self.n_components) + self.b
+        elif self.w is not None:
             return np.dot(X, self.w) + self.b
         else:
-            XSV = self.fkernel(X, self.sv)
-            a_sv_y = np.multiply(self.a, self.sv_y)
-            y_predict = [np.sum(np.multiply(np.multiply(self.a, self.sv_y), XSV[i, :])) for i in range(len(X))]
-
-            return y_predict + self.b
+            a_sv_y = np.asarray(self.a_sv_y, dtype=self.dtype)  # the kernel block is never upcast
+            return self._batched(lambda x: np.dot(self.fkernel(x, self.sv), a_sv_y),
+                                 X, len(self.sv), np.dtype(self.dtype).itemsize) + self.b
+
+    def save(self, path):
+        # save only what inference needs, as raw .npy arrays plus a small json header in the directory path,
+        # so that load can memory-map the arrays and several processes share one copy in the page cache
+        if self.kernel_approx is not None:
+            raise ValueError('saving a kernel_approx model is not supported')
+        os.makedirs(path, exist_ok=True)
+        arrays = {'w': self.w} if self.w is not None else {'sv': self.sv, 'a_sv_y': self.a_sv_y}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array, dtype=np.double))
+        header = {'format': MODEL_FORMAT, 'version': MODEL_VERSION, 'class': type(self).__name__,
+                  'kernel': self.kernel, 'gamma': self.gamma, 'dtype': np.dtype(self.dtype).name,
+                  'b': float(self.b), 'arrays': sorted(arrays)}
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump(header, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'model.json')) as f:
+            header = json.load(f)
+        if header.get('format') != MODEL_FORMAT or header.get('version') != MODEL_VERSION:
+            raise ValueError('{} is not a version {} {} model'.format(path, MODEL_VERSION, MODEL_FORMAT))
+        model = cls(kernel=header['kernel'], gamma=header['gamma'],
+                    dtype=np.dtype(header.get('dtype', 'float64')).type)
+        model._set_kernel()
+        model.b = header['b']
+        model.w = None
+        for name in header['arrays']:
+            setattr(model, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+        return model
 
     def decision_function(self, X):
         return self.project(X)
@@ -177,138 +782,26 @@ class PFERM(FERM):
     # def __init__(self, kernel='rbf', C=1.0, sensible_feature=None, gamma=1.0, prior=False, pi=1):
     #     super().__init__(kernel=kernel, C=C, sensible_feature=sensible_feature, gamma=gamma, prior=prior, pi=pi)
 
-    def fit(self, X, y):
-        if self.kernel == 'rbf':
-            self.fkernel = lambda x, y: rbf_kernel(x, y, self.gamma)
-        elif self.kernel == 'linear':
-            self.fkernel = linear_kernel
-        else:
-            self.fkernel = linear_kernel
-
-        if self.fairness:
-            self.values_of_sensible_feature = np.unique(self.sensible_feature) # sorted feature values small to large
-
-            self.group_idx_list = []  # the index list of each group with positive class, such as male and female or different races
-
-            if self.constraint == 'EO':  # equalized odds as constraint
-                for val in self.values_of_sensible_feature:
-                    self.group_idx_list.append(
-                        [idx for idx, ex in enumerate(X)
-                         if y[idx] == 1 and self.sensible_feature[idx] == val])
-            else:  # demographic parity as constraint
-                for val in self.values_of_sensible_feature:
-                    self.group_idx_list.append(
-                        [idx for idx, ex in enumerate(X)
-                         if self.sensible_feature[idx] == val])
-
-            self.n_list = [len(idx) for idx in self.group_idx_list]  # number of positive instances in each group
-
-            # print('self.val0:', self.val0)
-            # print('self.val1:', self.val1)
-            # print('(y, self.sensible_feature):')
-            # for el in zip(y, self.sensible_feature):
-            #     print(el)
-            # self.set_1 = [idx for idx, ex in enumerate(X) if y[idx] == 1]  # index of positive instances
-            # self.n_1 = len(self.set_1)  # number of positive instances
-
-        n_samples, n_features = X.shape
-
-        # Gram matrix
-        K = self.fkernel(X, X)
-
-        P = cvxopt.matrix(np.outer(y, y) * K)
-        q = cvxopt.matrix(np.ones(n_samples) * -1)
-        # print(y)
-        A = cvxopt.matrix(y.astype(np.double), (1, n_samples), 'd')
-        b = cvxopt.matrix(0.0)
-
-        if self.C is None:  # \alpha should be larger than 0
-            G = cvxopt.matrix(np.diag(np.ones(n_samples) * -1))
-            h = cvxopt.matrix(np.zeros(n_samples))
-        else:  # \alpha should be between 0 and C
-            tmp1 = np.diag(np.ones(n_samples) * -1)
-            tmp2 = np.identity(n_samples)
-            G = cvxopt.matrix(np.vstack((tmp1, tmp2)))
-            tmp1 = np.zeros(n_samples)
-            tmp2 = np.ones(n_samples) * self.C
-            h = cvxopt.matrix(np.hstack((tmp1, tmp2)))
-
-        # Stack the fairness constraint
-        if self.fairness:
-            if self.prior: # prior knowledge that the probability of female getting AD is twice that of male
-                self.tau_list = []
-                first_group_idx = self.group_idx_list[0]
-                first_n = self.n_list[0]
-                for i, (group_idx, current_n) in enumerate(zip(self.group_idx_list, self.n_list)):
-                    if i == 0:
-                        continue
-                    if isinstance(self.pi, list):
-                        self.tau_list.append(
-                            [(np.sum(K[group_idx, idx]) / current_n) -
-                             ((1 - self.lamda) * self.pi[i-1] + self.lamda) * (np.sum(K[first_group_idx, idx]) / first_n)
-                             for idx in range(len(y))])
-                    else:
-                        self.tau_list.append(
-                            [(np.sum(K[group_idx, idx]) / current_n) -
-                             ((1 - self.lamda) * self.pi + self.lamda) * (np.sum(K[first_group_idx, idx]) / first_n)
-                             for idx in range(len(y))])
-
-            else:
-                self.tau_list = []
-                first_group_idx = self.group_idx_list[0]
-                first_n = self.n_list[0]
-                for i, (group_idx, current_n) in enumerate(zip(self.group_idx_list, self.n_list)):
-                    if i == 0:
-                        continue
-                    self.tau_list.append(
-                        [(np.sum(K[group_idx, idx]) / current_n) -
-                         (np.sum(K[first_group_idx, idx]) / first_n)
-                           for idx in range(len(y))])
-            # print('self.n_A1:', self.n_A1)
-            # print('self.n_not_A1:', self.n_not_A1)
-            # print('tau:', self.tau_list)
-            # print('A:', A.size, np.sum(A[0,:]))
-            A_list = [A]
-            for tau in self.tau_list:
-                A_list.append(matrix(y * tau, (1, n_samples), 'd'))
-            A = cvxopt.matrix(np.vstack(A_list))
-            b = cvxopt.matrix([0.0] * len(A_list))
-
-            # print('A tau 1:', A.size, np.sum(A[1, :]))
-            # print('A tau 2:', A.size, np.sum(A[2, :]))
-
-        # solve QP problem
-        cvxopt.solvers.options['show_progress'] = False
-        # print('A:', A)
-        # print('Rank(A):', np.linalg.matrix_rank(A))
-        # print('Rank([P; A; G])', np.linalg.matrix_rank(np.vstack([P, A, G])))
-        solution = cvxopt.solvers.qp(P, q, G, h, A, b)
+    def _group_values(self):
+        return self.values_of_sensible_feature
 
-        # Lagrange multipliers
-        a = np.ravel(solution['x'])
+    def _prepare_fit(self, X, y, sensitive_features=None, sample_weight=None):
+        self._set_kernel()
+        self.sensitive_ = self._sensitive(X, sensitive_features)
+        self.fairness = self.sensitive_ is not None
+        self.sample_weight_ = self._sample_weight(X, sample_weight)
+        self.fit_stats_['n_samples'] = len(X)
 
-        # Support vectors have non zero lagrange multipliers
-        sv = a > 1e-7
-        ind = np.arange(len(a))[sv]
-        self.a = a[sv]
-        self.sv = X[sv]
-        self.sv_y = y[sv]
-        # print("%d support vectors out of %d points" % (len(self.a), n_samples))
+        if self.fairness:
+            self.values_of_sensible_feature = np.unique(self.sensitive_) # sorted feature values small to large
 
-        # Intercept
-        self.b = 0
-        for n in range(len(self.a)):
-            self.b += self.sv_y[n]
-            self.b -= np.sum(self.a * self.sv_y * K[ind[n], sv])
-        self.b /= len(self.a)
-
-        # Weight vector
-        if self.kernel == linear_kernel:
-            self.w = np.zeros(n_features)
-            for n in range(len(self.a)):
-                self.w += self.a[n] * self.sv_y[n] * self.sv[n]
-        else:
-            self.w = None
+            # the indicator of each group with positive class (EO) or of each whole group (DP),
+            # such as male and female or different races
+            self.group_indicator = group_indicator(self.sensitive_,
+                                                   y if self.constraint == 'EO' else None,
+                                                   self.values_of_sensible_feature, self.sample_weight_)
+            self.group_idx_list = [np.flatnonzero(ind) for ind in self.group_indicator]
+            self.n_list = [len(idx) for idx in self.group_idx_list]  # number of instances in each group
 
 
 if __name__ == "__main__":
@@ -355,7 +848,7 @@ if __name__ == "__main__":
 
     #  FERM algorithm
     print('\n\nGrid search for original FERM...')
-    algorithm = FERM(sensible_feature=dataset_train.data[:, sensible_feature])
+    algorithm = FERM(sensible_feature=sensible_feature)
     clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
     clf.fit(dataset_train.data, dataset_train.target)
     # print('Best Fair Estimator:', clf.best_estimator_)
@@ -378,7 +871,7 @@ if __name__ == "__main__":
 
     #  FERM algorithm
     print('\n\nGrid search for new FERM...')
-    algorithm = PFERM(sensible_feature=dataset_train.data[:, sensible_feature])
+    algorithm = PFERM(sensible_feature=sensible_feature)
     clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
     clf.fit(dataset_train.data, dataset_train.target)
     # print('Best Fair Estimator:', clf.best_estimator_)
@@ -401,7 +894,7 @@ if __name__ == "__main__":
 
     #  PFERM algorithm
     print('\n\nGrid search for original PFERM...')
-    algorithm = FERM(sensible_feature=dataset_train.data[:, sensible_feature], prior=True, pi=pi)
+    algorithm = FERM(sensible_feature=sensible_feature, prior=True, pi=pi)
     clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
     clf.fit(dataset_train.data, dataset_train.target)
     # print('Best Fair Estimator:', clf.best_estimator_)
@@ -424,7 +917,7 @@ if __name__ == "__main__":
 
     #  PFERM algorithm
     print('\n\nGrid search for new PFERM...')
-    algorithm = PFERM(sensible_feature=dataset_train.data[:, sensible_feature], prior=True, pi=pi)
+    algorithm = PFERM(sensible_feature=sensible_feature, prior=True, pi=pi)
     clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
     clf.fit(dataset_train.data, dataset_train.target)
     # print('Best Fair Estimator:', clf.best_estimator_)
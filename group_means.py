@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def group_indicator(sensible_feature, y=None, values=None, sample_weight=None):
+    '''
+    Membership of every sample in each group, built in one pass.
+    :param sensible_feature: the sensitive feature of every sample.
+    :param y: if given, only the positive samples (y == 1) are members, as needed by equalized odds (EO),
+    otherwise all the samples are members, as needed by demographic parity (DP).
+    :param values: the values defining the groups, by default all the values sorted from small to large.
+    :param sample_weight: the weight of every sample, the group means are then weighted means.
+    :return: a g x n boolean matrix whose k-th row marks the members of the k-th group, or holds their weights
+    if sample_weight is given.
+    '''
+    sensible_feature = np.asarray(sensible_feature)
+    if values is None:
+        values = np.unique(sensible_feature)
+    indicator = sensible_feature[np.newaxis, :] == np.asarray(values)[:, np.newaxis]
+    if y is not None:
+        indicator &= (np.asarray(y) == 1)[np.newaxis, :]
+    if sample_weight is not None:
+        indicator = indicator * np.asarray(sample_weight, dtype=np.double)[np.newaxis, :]
+    return indicator
+
+
+def group_weights(indicator):
+    # each row of the indicator normalized by the size (or the total weight) of its group
+    return indicator / np.sum(indicator, axis=1, keepdims=True)
+
+
+def group_feature_means(Z, indicator):
+    # mean of the explicit features Z (n x m) over every group, a g x m matrix
+    return group_weights(indicator).dot(Z)
+
+
+def group_kernel_means(fkernel, X, indicator, K=None, block_size=1000, at=None):
+    '''
+    Kernel mean embedding of every group evaluated at every sample, i.e. np.sum(K[group_idx, idx]) / n_group
+    for all the groups and all idx, computed with a single matrix product of the normalized indicator and K.
+    If K is None the product is streamed over blocks of rows of K, only the rows of group members are
+    evaluated and the n x n Gram matrix is never built.
+    :param fkernel: the kernel function.
+    :param X: the samples.
+    :param indicator: the g x n group indicator, see group_indicator.
+    :param K: the Gram matrix, if already available.
+    :param block_size: the number of rows of K evaluated at once.
+    :param at: the points where the means are evaluated, X by default. The blocks are then
+    block_size x len(at) and the cost is O(n * len(at)), K is not used.
+    :return: a g x n (or g x len(at)) matrix of the group means.
+    '''
+    # the weights take the dtype of K, so that a single precision K is never upcast
+    weights = group_weights(indicator)
+    if K is not None and at is None:
+        return weights.astype(K.dtype, copy=False).dot(K)
+
+    at = X if at is None else at
+    rows = np.flatnonzero(np.any(indicator, axis=0))
+    means = np.zeros((len(indicator), len(at)))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        K_block = fkernel(X[block], at)
+        means += weights[:, block].astype(K_block.dtype, copy=False).dot(K_block)
+    return means
@@ -0,0 +1,83 @@
+import numpy as np
+import hashlib
+import os
+from sklearn import svm
+from sklearn.base import BaseEstimator
+from sklearn.metrics import accuracy_score
+from sklearn.metrics.pairwise import rbf_kernel, linear_kernel
+
+
+class KernelCache:
+    # Persistent cache of Gram blocks K(X1, X2) on disk, keyed by the content of X1, X2 and the kernel
+    # parameters. The blocks are stored as .npy files and returned memory-mapped, the least recently
+    # used ones are evicted when the cache grows over max_bytes.
+    def __init__(self, cache_dir='./kernel_cache', max_bytes=4 * 2 ** 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, X1, X2, kernel, gamma):
+        fingerprint = hashlib.sha1()
+        for X in (X1, X2):
+            X = np.ascontiguousarray(X)
+            fingerprint.update('{}{}'.format(X.shape, X.dtype).encode())
+            fingerprint.update(X.tobytes())
+        # gamma does not change the linear kernel
+        fingerprint.update('{}{}'.format(kernel, gamma if kernel == 'rbf' else '').encode())
+        return fingerprint.hexdigest()
+
+    def gram(self, X1, X2, kernel='rbf', gamma=1.0):
+        path = os.path.join(self.cache_dir, self.key(X1, X2, kernel, gamma) + '.npy')
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used
+            return np.load(path, mmap_mode='r')
+
+        K = rbf_kernel(X1, X2, gamma) if kernel == 'rbf' else linear_kernel(X1, X2)
+        if K.nbytes <= self.max_bytes:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())  # concurrent workers never read partial files
+            with open(tmp_path, 'wb') as f:
+                np.save(f, K)
+            os.replace(tmp_path, path)
+            self.evict(keep=path)
+        return K
+
+    def evict(self, keep=None):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.npy')]
+        files = sorted(files, key=lambda f: os.path.getmtime(f))  # least recently used first
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= self.max_bytes:
+                break
+            if f == keep:
+                continue
+            total -= os.path.getsize(f)
+            os.remove(f)
+
+
+class PrecomputedSVC(BaseEstimator):
+    # The SVM baseline trained on a precomputed kernel served by a KernelCache
+    def __init__(self, kernel='rbf', C=1.0, gamma=1.0, kernel_cache=None):
+        self.kernel = kernel
+        self.C = C
+        self.gamma = gamma
+        self.kernel_cache = kernel_cache
+
+    def _gram(self, X1, X2):
+        if self.kernel_cache is None:
+            return rbf_kernel(X1, X2, self.gamma) if self.kernel == 'rbf' else linear_kernel(X1, X2)
+        return self.kernel_cache.gram(X1, X2, self.kernel, self.gamma)
+
+    def fit(self, X, y):
+        self.X_train = X
+        self.model = svm.SVC(kernel='precomputed', C=self.C)
+        self.model.fit(self._gram(X, X), y)
+        return self
+
+    def decision_function(self, X):
+        return self.model.decision_function(self._gram(X, self.X_train))
+
+    def predict(self, X):
+        return self.model.predict(self._gram(X, self.X_train))
+
+    def score(self, X_test, y_test):
+        return accuracy_score(y_test, self.predict(X_test))
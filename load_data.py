@@ -17,6 +17,8 @@ def load_dataset(name='tadpole', seed=42, pi=2):
         return load_tadpole(seed)
     elif name == 'av45':
         return load_tadpole_AV45(seed)
+    elif name == 'av45_multi':
+        return load_tadpole_AV45(seed, version=3)
     elif name == 'adult':
         return load_adult(seed, smaller=True)
     elif name == 'toy':
@@ -189,6 +191,14 @@ def load_tadpole_AV45(seed=42, version=1, verbose=False):
 
         y[y=='MCI'] = 0
         y[y=='AD'] = 1
+    elif version == 3:  # CN vs MCI vs AD, for MulticlassPFERM
+        print("AV45 dataset preprocessing ... version 3: CN vs MCI vs AD")
+        # pi of every diagnosis, the ratio between females and males, used when the diagnosis is the positive class
+        pi = {label: len(y[(y == disease) & (group == 'Female')]) / len(y[(y == disease) & (group == 'Male')])
+              for label, disease in enumerate(['CN', 'MCI', 'AD'])}
+        y[y=='CN'] = 0
+        y[y=='MCI'] = 1
+        y[y=='AD'] = 2
 
     X = df_cort_clean[demographic + cortical_full_name].copy()
     X.loc[X['PTGENDER'] == 'Male', 'PTGENDER'] = 0
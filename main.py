@@ -4,9 +4,12 @@ import time
 from load_data import load_dataset
 from linear_ferm import Linear_FERM
 from ferm import FERM, PFERM
+from kernel_cache import KernelCache, PrecomputedSVC
 from sklearn import svm
-from measures import evaluate
-from sklearn.model_selection import GridSearchCV
+from measures import evaluate, fit_stats_scoring, collect_fit_stats, print_fit_stats
+from sklearn.model_selection import GridSearchCV, ParameterGrid
+from parallel import split_cores
+from tiered_search import TwoTierGridSearchCV
 from collections import namedtuple
 from plot import plot_box
 import pickle as pkl
@@ -26,37 +29,59 @@ def train_test(X_train, X_test, y_train, y_test, sensible_feature_idx, args, pi,
                      'gamma': [0.1, 0.01],
                      'kernel': [kernel]}]
 
+    # the cores are split between the parallel fits of the grid search (5 folds per candidate) and the
+    # BLAS threads of each fit
+    n_jobs, n_threads = split_cores(args.n_jobs, 5 * len(ParameterGrid(param_grid)), args.n_threads)
+    # with two tiers, the (P)FERM candidates are scored from loose solves and only the best one is solved
+    # to full precision
+    search = TwoTierGridSearchCV if args.search == 'two_tier' else GridSearchCV
+
+    # the Gram matrices of every fold and candidate are kept on disk and reused by later runs
+    kernel_cache = None
+    if args.kernel_cache:
+        kernel_cache = KernelCache(args.kernel_cache, int(args.kernel_cache_size * 2 ** 30))
+
     print('Grid search for SVM...')
-    svc = svm.SVC(kernel=kernel)
-    clf = GridSearchCV(svc, param_grid, n_jobs=1)
+    if kernel_cache is not None:
+        svc = PrecomputedSVC(kernel=kernel, kernel_cache=kernel_cache)
+    else:
+        svc = svm.SVC(kernel=kernel)
+    clf = GridSearchCV(svc, param_grid, n_jobs=n_jobs)
     clf.fit(X_train, y_train)
     print('Best Estimator:', clf.best_estimator_)
     train_acc_SVM, train_bacc_SVM, test_acc_SVM, test_bacc_SVM, DEO_SVM, DDP_SVM \
         = evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi)
 
     print('Grid search for FERM...')
-    algorithm = PFERM(sensible_feature=X_train[:, sensible_feature_idx],
-                      kernel=kernel, prior=False, constraint=args.constraint, lamda=args.lamda)
-    clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
+    # the sensitive feature is the column sensible_feature_idx of X, so every CV fold fits on its own samples
+    algorithm = PFERM(sensible_feature=sensible_feature_idx,
+                      kernel=kernel, prior=False, constraint=args.constraint, lamda=args.lamda,
+                      kernel_cache=kernel_cache, n_threads=n_threads)
+    clf = search(algorithm, param_grid, scoring=fit_stats_scoring(), refit='score', n_jobs=n_jobs)
     clf.fit(X_train, y_train)
     print('Best Estimator: FERM(C={}, gamma={})'.
           format(clf.best_estimator_.C, clf.best_estimator_.gamma))
+    fit_stats = {'FERM': collect_fit_stats(clf.cv_results_)}
+    print_fit_stats(fit_stats['FERM'])
     train_acc_FERM, train_bacc_FERM, test_acc_FERM, test_bacc_FERM, DEO_FERM, DDP_FERM \
         = evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi)
 
     print('Grid search for PFERM...')
-    algorithm = PFERM(sensible_feature=X_train[:, sensible_feature_idx],
-                      kernel=kernel, prior=True, pi=pi, constraint=args.constraint, lamda=args.lamda)
-    clf = GridSearchCV(algorithm, param_grid, n_jobs=1)
+    algorithm = PFERM(sensible_feature=sensible_feature_idx,
+                      kernel=kernel, prior=True, pi=pi, constraint=args.constraint, lamda=args.lamda,
+                      kernel_cache=kernel_cache, n_threads=n_threads)
+    clf = search(algorithm, param_grid, scoring=fit_stats_scoring(), refit='score', n_jobs=n_jobs)
     clf.fit(X_train, y_train)
     print('Best Estimator: PFERM(C={}, gamma={})'.
           format(clf.best_estimator_.C, clf.best_estimator_.gamma))
+    fit_stats['PFERM'] = collect_fit_stats(clf.cv_results_)
+    print_fit_stats(fit_stats['PFERM'])
     train_acc_PFERM, train_bacc_PFERM, test_acc_PFERM, test_bacc_PFERM, DEO_PFERM, DDP_PFERM \
         = evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi)
 
     return test_acc_SVM, test_acc_FERM, test_acc_PFERM, \
            DEO_SVM, DEO_FERM, DEO_PFERM, \
-           DDP_SVM, DDP_FERM, DDP_PFERM
+           DDP_SVM, DDP_FERM, DDP_PFERM, fit_stats
 
 
 def main_bak(dataset, seed=42):
@@ -109,7 +134,7 @@ def main_bak(dataset, seed=42):
         = evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi)
 
     print('Grid search for NonLinear FERM...')
-    algorithm = PFERM(sensible_feature=X_train[:, sensible_feature_idx])
+    algorithm = PFERM(sensible_feature=sensible_feature_idx)
     clf = GridSearchCV(algorithm, param_grid_nonlinear, n_jobs=1)
     clf.fit(X_train, y_train)
     print('Best Estimator: Nonlinear FERM(C={}, gamma={})'.
@@ -118,7 +143,7 @@ def main_bak(dataset, seed=42):
         = evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi)
 
     print('Grid search for NonLinear PFERM...')
-    algorithm = PFERM(sensible_feature=X_train[:, sensible_feature_idx], prior=True, pi=pi)
+    algorithm = PFERM(sensible_feature=sensible_feature_idx, prior=True, pi=pi)
     clf = GridSearchCV(algorithm, param_grid_nonlinear, n_jobs=1)
     clf.fit(X_train, y_train)
     print('Best Estimator: Nonlinear PFERM(C={}, gamma={})'.
@@ -142,6 +167,7 @@ def main(dataset, args, is_linear=False, pi=2):
     DEO_SVM_list, DEO_FERM_list, DEO_PFERM_list, \
     DDP_SVM_list, DDP_FERM_list, DDP_PFERM_list, \
         = [], [], [], [], [], [], [], [], []
+    fit_stats_list = []  # the fit_stats_ of the grid search candidates of every seed
 
     for seed in [0, 42, 66, 666, 777]:
         print('\n========================seed {}========================'.format(seed))
@@ -150,7 +176,7 @@ def main(dataset, args, is_linear=False, pi=2):
 
         test_acc_SVM, test_acc_FERM, test_acc_PFERM, \
         DEO_SVM, DEO_FERM, DEO_PFERM, \
-        DDP_SVM, DDP_FERM, DDP_PFERM \
+        DDP_SVM, DDP_FERM, DDP_PFERM, fit_stats \
             = train_test(X_train, X_test, y_train, y_test, sensible_feature_idx, args, pi, is_linear=is_linear)
 
         test_acc_SVM_list.append(test_acc_SVM)
@@ -158,6 +184,7 @@ def main(dataset, args, is_linear=False, pi=2):
         test_acc_PFERM_list.append(test_acc_PFERM)
         DEO_SVM_list.append(DEO_SVM), DEO_FERM_list.append(DEO_FERM), DEO_PFERM_list.append(DEO_PFERM)
         DDP_SVM_list.append(DDP_SVM), DDP_FERM_list.append(DDP_FERM), DDP_PFERM_list.append(DDP_PFERM)
+        fit_stats_list.append(fit_stats)
 
     result_mean, result_std = {}, {}
     result_mean['ACC'] = [np.mean(test_acc_SVM_list), np.mean(test_acc_FERM_list), np.mean(test_acc_PFERM_list)]
@@ -183,7 +210,7 @@ def main(dataset, args, is_linear=False, pi=2):
     print('DEO Mean±Std {:.4f}±{:.4f}'.format(np.mean(DEO_PFERM_list), np.std(DEO_PFERM_list)))
     print('DDP Mean±Std {:.4f}±{:.4f}'.format(np.mean(DDP_PFERM_list), np.std(DDP_PFERM_list)))
 
-    result = {'mean': result_mean, 'std': result_std}
+    result = {'mean': result_mean, 'std': result_std, 'fit_stats': fit_stats_list}
     with open('./results/result_{}_{}_constraint_{}.pkl'.format(dataset, pi, args.constraint), 'wb') as f:
         pkl.dump(result, f)
 
@@ -198,6 +225,15 @@ if __name__ == "__main__":
     parser.add_argument("--dataset", type=str, help="dataset name", default="av45")
     parser.add_argument("--constraint", type=str, help="EO or DP as constrain", default='EO')
     parser.add_argument("--lamda", type=float, help="the trade-off parameter of the pi", default=0.5)
+    parser.add_argument("--kernel_cache", type=str, help="directory of the on-disk kernel cache", default=None)
+    parser.add_argument("--kernel_cache_size", type=float, help="disk budget of the kernel cache in GB", default=4)
+    parser.add_argument("--search", type=str, help="full or two_tier, the tolerances of the grid search "
+                                                   "candidates of FERM/PFERM, two_tier scores them with loose "
+                                                   "solves and may select other hyperparameters", default='full')
+    parser.add_argument("--n_jobs", type=int, help="parallel fits of the grid search, -1 for all the cores",
+                        default=1)
+    parser.add_argument("--n_threads", type=int, help="BLAS threads of each fit, by default the cores left "
+                                                       "to each parallel fit", default=None)
     args = parser.parse_args()
 
     print(args.constraint)
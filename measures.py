@@ -161,4 +161,43 @@ def evaluate(X_train, X_test, y_train, y_test, clf, sensible_feature_idx, pi=1):
 
     print_results_single(train_acc, train_bacc, test_acc, test_bacc, DEO, DDP)
 
-    return train_acc, train_bacc, test_acc, test_bacc, DEO, DDP
\ No newline at end of file
+    return train_acc, train_bacc, test_acc, test_bacc, DEO, DDP
+
+FIT_STATS = ['kernel_time', 'group_time', 'assembly_time', 'solve_time', 'intercept_time', 'iterations', 'n_sv',
+             'peak_bytes']
+
+
+def fit_stats_scoring(keys=FIT_STATS):
+    '''
+    Scoring of GridSearchCV collecting the fit_stats_ of the FERM/PFERM fits: every numeric entry is exposed
+    as a scorer, so cv_results_ holds mean_test_<key> and std_test_<key> for every candidate.
+    Use it with refit='score'.
+    :param keys: the entries of fit_stats_ to collect.
+    :return: a dictionary of scorers, 'score' being the accuracy of the estimator.
+    '''
+    def stat_scorer(key):
+        def scorer(estimator, X, y):
+            value = getattr(estimator, 'fit_stats_', {}).get(key)
+            return np.nan if value is None else float(value)
+        return scorer
+
+    scoring = {'score': lambda estimator, X, y: estimator.score(X, y)}
+    for key in keys:
+        scoring[key] = stat_scorer(key)
+    return scoring
+
+
+def collect_fit_stats(cv_results, keys=FIT_STATS):
+    # the mean fit_stats_ of every candidate of a GridSearchCV fitted with fit_stats_scoring
+    return [dict({'params': params}, **{key: cv_results['mean_test_' + key][i] for key in keys})
+            for i, params in enumerate(cv_results['params'])]
+
+
+def print_fit_stats(candidates):
+    print('{:<32}{:>9}{:>9}{:>9}{:>9}{:>9}{:>7}{:>7}{:>10}'.format(
+        'params', 'kernel', 'group', 'assembly', 'solve', 'intercpt', 'iters', 'n_sv', 'peak MB'))
+    for stats in candidates:
+        print('{:<32}{:>9.3f}{:>9.3f}{:>9.3f}{:>9.3f}{:>9.3f}{:>7.0f}{:>7.0f}{:>10.1f}'.format(
+            str({k: v for k, v in stats['params'].items() if k not in ('kernel', 'tol_tier')}), stats['kernel_time'],
+            stats['group_time'], stats['assembly_time'], stats['solve_time'], stats['intercept_time'],
+            stats['iterations'], stats['n_sv'], stats['peak_bytes'] / 2 ** 20))
@@ -0,0 +1,131 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import accuracy_score
+from ferm import PFERM
+from parallel import split_cores
+
+
+def fit_subproblem(estimator, X, y, gram_path, idx, group_means, sensitive_features):
+    # fit one binary subproblem in a worker process on the rows and columns idx of the memory-mapped Gram
+    # matrix, None for all of them (one-vs-rest)
+    K = np.load(gram_path, mmap_mode='r')
+    if idx is not None:
+        K = K[np.ix_(idx, idx)]
+    return estimator.fit_precomputed(X, y, K, group_means, sensitive_features)
+
+
+class MulticlassPFERM(BaseEstimator):
+    '''
+    Multi-class PFERM (e.g. CN / MCI / AD) by one-vs-rest or one-vs-one binary subproblems. The Gram matrix is
+    built once on all the samples into a memory-mapped file, the kernel means of every (group, class) cell
+    are computed once from it, and the subproblems are fitted in worker processes which map the same file
+    and combine the cell means into the group means of their own samples. In a subproblem the positive class
+    is the class of one-vs-rest, or the larger label of the pair of one-vs-one.
+    :param estimator: the binary PFERM (or FERM) of the subproblems, with a dense QP backend as solver.
+    :param strategy: 'ovr' (one-vs-rest) or 'ovo' (one-vs-one, one subproblem per diagnostic contrast).
+    :param pi: a dictionary of the pi of the prior of every class, used when it is the positive class,
+    None keeps the pi of the estimator.
+    :param n_jobs: the number of worker processes, None for all the cores (at most the subproblems), 1 fits
+    the subproblems in this process.
+    :param memmap_dir: the directory of the memory-mapped Gram matrix, a temporary one by default.
+    '''
+    def __init__(self, estimator=None, strategy='ovr', pi=None, n_jobs=None, memmap_dir=None):
+        self.estimator = estimator
+        self.strategy = strategy
+        self.pi = pi
+        self.n_jobs = n_jobs
+        self.memmap_dir = memmap_dir
+
+    def _subproblems(self):
+        # the key, the positive class and the classes of the samples of every subproblem
+        if self.strategy == 'ovr':
+            return [(c, c, self.classes_) for c in self.classes_]
+        elif self.strategy == 'ovo':
+            return [((c0, c1), c1, np.array([c0, c1])) for c0, c1 in itertools.combinations(self.classes_, 2)]
+        raise ValueError('strategy should be ovr or ovo, got {}'.format(self.strategy))
+
+    def _group_means(self, constraint, values, positive, classes, idx):
+        # the kernel means of the groups of a subproblem at its samples idx, from the means of the cells:
+        # the positive members of each group (EO) or all the members of the subproblem in each group (DP)
+        rows = [np.flatnonzero(self.values_ == v)[0] for v in values]
+        columns = slice(None) if idx is None else idx
+        if constraint == 'EO':
+            k = np.flatnonzero(self.classes_ == positive)[0]
+            return self.cell_means_[rows, k][:, columns]
+        ks = [np.flatnonzero(self.classes_ == c)[0] for c in classes]
+        counts = self.cell_counts_[rows][:, ks]
+        sums = np.einsum('gc,gcn->gn', counts, self.cell_means_[rows][:, ks][:, :, columns])
+        return sums / np.sum(counts, axis=1)[:, np.newaxis]
+
+    def fit(self, X, y, sensitive_features=None):
+        base = PFERM() if self.estimator is None else self.estimator
+        X, y = np.asarray(X), np.asarray(y)
+        sensitive = base._sensitive(X, sensitive_features)
+        self.classes_ = np.unique(y)
+
+        memmap_dir = tempfile.mkdtemp(dir=self.memmap_dir)
+        try:
+            gram_path = os.path.join(memmap_dir, 'gram.npy')
+            kernel = clone(base)
+            kernel._set_kernel()
+            K = np.lib.format.open_memmap(gram_path, mode='w+', dtype=np.dtype(kernel.dtype),
+                                          shape=(len(X), len(X)))
+            kernel._dense_kernel(np.asarray(X, dtype=kernel.dtype), K)
+            K.flush()
+
+            if sensitive is not None:
+                # the kernel means of every (group, class) cell, a g x c x n array
+                self.values_ = np.unique(sensitive)
+                cells = np.array([[(sensitive == v) & (y == c) for c in self.classes_] for v in self.values_])
+                self.cell_counts_ = np.sum(cells, axis=2)
+                # a single pass over K, the empty cells get zero means
+                weights = cells.reshape(-1, len(X)) / np.maximum(self.cell_counts_.reshape(-1, 1), 1)
+                means = weights.astype(K.dtype).dot(K)
+                self.cell_means_ = means.reshape(len(self.values_), len(self.classes_), len(X))
+
+            subproblems = self._subproblems()
+            n_jobs, n_threads = split_cores(self.n_jobs, len(subproblems), base.n_threads)
+            jobs = []
+            for key, positive, classes in subproblems:
+                idx = None if self.strategy == 'ovr' else np.flatnonzero(np.isin(y, classes))
+                rows = slice(None) if idx is None else idx
+                estimator = clone(base).set_params(n_threads=n_threads)
+                if self.pi is not None:
+                    estimator.set_params(pi=self.pi[positive])
+                group_means = None if sensitive is None \
+                    else self._group_means(base.constraint, np.unique(sensitive[rows]), positive, classes, idx)
+                jobs.append((estimator, X[rows], np.where(y[rows] == positive, 1.0, -1.0), gram_path, idx,
+                             group_means, None if sensitive is None else sensitive[rows]))
+            if self.n_jobs == 1:
+                models = [fit_subproblem(*job) for job in jobs]
+            else:
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    models = list(pool.map(fit_subproblem, *zip(*jobs)))
+            del K
+        finally:
+            shutil.rmtree(memmap_dir, ignore_errors=True)
+
+        self.estimators_ = {key: model for (key, _, _), model in zip(subproblems, models)}
+        return self
+
+    def decision_function(self, X):
+        # one-vs-rest: the decision value of every class, one-vs-one: the votes of the pairs for every class
+        if self.strategy == 'ovr':
+            return np.stack([self.estimators_[c].decision_function(X) for c in self.classes_], axis=1)
+        votes = np.zeros((len(X), len(self.classes_)))
+        for (c0, c1), model in self.estimators_.items():
+            positive = model.decision_function(X) > 0
+            votes[:, np.flatnonzero(self.classes_ == c1)[0]] += positive
+            votes[:, np.flatnonzero(self.classes_ == c0)[0]] += ~positive
+        return votes
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+    def score(self, X_test, y_test):
+        return accuracy_score(y_test, self.predict(X_test))
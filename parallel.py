@@ -0,0 +1,49 @@
+import os
+import functools
+from threadpoolctl import threadpool_limits
+
+
+def available_cores():
+    # the cores this process may run on, which can be fewer than the cores of the machine
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_cores(n_jobs=None, n_tasks=None, n_threads=None):
+    '''
+    Split the cores between n_jobs worker processes and n_threads BLAS threads in each of them, so that
+    n_jobs * n_threads does not exceed the cores and the workers do not oversubscribe them.
+    :param n_jobs: the number of worker processes, None for one per core, negative values count back from
+    the cores as in joblib (-1 is all the cores, -2 all but one).
+    :param n_tasks: the number of independent fits, the workers are never more than the tasks so that the
+    idle cores go to the BLAS threads instead.
+    :param n_threads: the BLAS threads of each worker, None for an even share of the cores.
+    :return: n_jobs, n_threads.
+    '''
+    cores = available_cores()
+    if n_jobs is None:
+        n_jobs = cores
+    elif n_jobs < 0:
+        n_jobs = cores + 1 + n_jobs
+    if n_tasks is not None:
+        n_jobs = min(n_jobs, n_tasks)
+    n_jobs = max(1, n_jobs)
+    if n_threads is None:
+        n_threads = max(1, cores // n_jobs)
+    return n_jobs, n_threads
+
+
+def limit_threads(method):
+    # run an estimator method with the BLAS and OpenMP thread pools (numpy, scipy and cvxopt) capped at
+    # the estimator's n_threads, None leaves them unchanged and calls the method directly: threadpool_limits
+    # inspects every loaded library (~2 ms) even without a limit
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        n_threads = getattr(self, 'n_threads', None)
+        if n_threads is None:
+            return method(self, *args, **kwargs)
+        with threadpool_limits(limits=n_threads):
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,125 @@
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+
+
+# Safe screening of the (P)FERM dual. The dual
+#     max 1^T a - 1/2 a^T Q a,  Q = (y y^T) * K,  s.t. 0 <= a <= C, y^T a = 0, F a = 0
+# with the fairness rows F_ki = y_i tau_k(x_i) is the dual of the primal
+#     min 1/2 ||w||^2 + sum_i C_i max(0, 1 - y_i (<w, phi(x_i)> + b + c^T tau(x_i)))
+# where the intercept b and the coefficients c of the fairness features tau are not regularized. A sample
+# with y_i f(x_i) > 1 at the primal optimum has a_i = 0 in every dual optimum, so it can leave the QP.
+
+# the LP bounds on the offsets hold up to the tolerances of HiGHS, the rule keeps this margin on top of them
+SCREENING_MARGIN = 1e-6
+
+
+def feasible_reference(a, y, C, F=None):
+    '''
+    Restore the equality rows y^T a = 0, F a = 0 of an approximate dual solution (e.g. a loose SMO solve,
+    whose fairness rows only hold up to feas_tol) by the least norm correction of its free multipliers.
+    :param a: the multipliers of the approximate solution, in the box.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier.
+    :param F: the (g-1) x n matrix of the fairness rows, None without fairness constraint.
+    :return: the corrected multipliers, or None if the correction leaves the box.
+    '''
+    A = y[np.newaxis, :] if F is None else np.vstack([y, F])
+    C = np.broadcast_to(C, a.shape)
+    free = np.flatnonzero((a > 0) & (a < C))
+    A_free = A[:, free]
+    if len(free) == 0:
+        return a if np.allclose(A.dot(a), 0.0, atol=1e-12) else None
+    shift = np.linalg.lstsq(A_free.dot(A_free.T), A.dot(a), rcond=None)[0]
+    a = a.copy()
+    a[free] -= A_free.T.dot(shift)
+    if np.any(a < 0) or np.any(a > C):
+        return None
+    return a
+
+
+def _offset_program(Y, margins, weights):
+    # the constraints t_i >= margins_i - Y_i^T theta, t >= 0 of the weighted hinge sum sum_i weights_i t_i over
+    # the variables (theta, t), theta being the offsets (b, c)
+    n, p = Y.shape
+    A_ub = sparse.hstack([sparse.csr_matrix(-Y), -sparse.identity(n, format='csr')]).tocsr()
+    bounds = [(None, None)] * p + [(0, None)] * n
+    cost = np.concatenate([np.zeros(p), weights])
+    return A_ub, -margins, bounds, cost
+
+
+def offset_bounds(Y, margins, weights, budget):
+    '''
+    The bounding box of the offsets theta whose weighted hinge sum stays within the budget,
+        sum_i weights_i max(0, margins_i - Y_i^T theta) <= budget,
+    by two linear programs per offset.
+    :return: the lower and the upper bounds of theta, None if a bound is infinite.
+    '''
+    n, p = Y.shape
+    A_ub, b_ub, bounds, cost = _offset_program(Y, margins, weights)
+    A_ub = sparse.vstack([A_ub, sparse.csr_matrix(cost)]).tocsr()
+    b_ub = np.concatenate([b_ub, [budget]])
+    low, high = np.empty(p), np.empty(p)
+    for k in range(p):
+        for sign, bound in ((1.0, low), (-1.0, high)):
+            objective = np.zeros(p + n)
+            objective[k] = sign
+            result = linprog(objective, A_ub=A_ub, b_ub=b_ub, bounds=bounds, method='highs')
+            if result.status != 0:
+                return None
+            bound[k] = result.x[k]
+    # HiGHS meets the constraints up to its feasibility tolerance, the box is widened by as much
+    slack = SCREENING_MARGIN * (1 + np.maximum(np.abs(low), np.abs(high)))
+    return low - slack, high + slack
+
+
+def gap_safe_screen(K, y, C, F, a):
+    '''
+    Gap safe screening of the (P)FERM dual from a reference dual solution a. The primal objective is
+    1-strongly convex in w, so ||w - w*||^2 <= 2 * gap for the w of a and the duality gap of a against its
+    best primal offsets, which bounds <w*, phi(x_i)> at every sample. The offsets (b*, c*) of the optimum
+    are bounded by the offsets whose hinge sum fits in the primal value left to the losses. A sample whose
+    margin y_i f(x_i) stays above 1 over all of them is not a support vector of any solution.
+    :param K: the Gram matrix.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier (C * sample_weight).
+    :param F: the (g-1) x n matrix of the fairness rows, None without fairness constraint.
+    :param a: the multipliers of the reference solution, e.g. a loose solve of the same problem.
+    :return: a boolean mask of the samples proven to be non support vectors, all False if a cannot be made
+    feasible or if the offsets are unbounded.
+    '''
+    y = np.asarray(y, dtype=np.double)
+    n = len(y)
+    screened = np.zeros(n, dtype=bool)
+    F = None if F is None else np.atleast_2d(np.asarray(F, dtype=np.double))
+    C = np.broadcast_to(np.asarray(C, dtype=np.double), (n,))
+    a = feasible_reference(np.asarray(a, dtype=np.double), y, C, F)
+    if a is None:
+        return screened
+
+    # the w of a, through its products <w, phi(x_i)> = (K (y * a))_i and its norm
+    scores = np.dot(K, (y * a).astype(K.dtype, copy=False)).astype(np.double)
+    norm2 = np.dot(y * a, scores)
+    dual = np.sum(a) - norm2 / 2
+
+    # the best offsets of the primal for the w of a
+    Y = y[:, np.newaxis] if F is None else np.column_stack([y, F.T])
+    A_ub, b_ub, bounds, cost = _offset_program(Y, 1 - y * scores, C)
+    result = linprog(cost, A_ub=A_ub, b_ub=b_ub, bounds=bounds, method='highs')
+    if result.status != 0:
+        return screened
+    theta = result.x[:Y.shape[1]]
+    primal = norm2 / 2 + np.dot(C, np.maximum(0.0, 1 - y * scores - Y.dot(theta)))
+    # rounding of the weak duality, so that a (near) zero gap still yields a safe radius
+    gap = max(primal - dual, 0.0) + 1e-12 * (1 + abs(primal))
+    radius = np.sqrt(2 * gap)
+
+    # the margins at the optimum are at least y_i <w, phi(x_i)> - radius * ||phi(x_i)|| + y_i (b + c^T tau_i)
+    reach = radius * np.sqrt(np.maximum(np.diagonal(K), 0.0))
+    budget = primal - max(0.0, np.sqrt(norm2) - radius) ** 2 / 2
+    box = offset_bounds(Y, 1 - y * scores - reach, C, budget)
+    if box is None:
+        return screened
+    low, high = box
+    offsets = np.sum(np.minimum(Y * low, Y * high), axis=1)
+    return y * scores - reach + offsets > 1 + SCREENING_MARGIN
@@ -0,0 +1,87 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import accuracy_score
+from ferm import PFERM
+from parallel import split_cores
+
+
+def fit_shard(estimator, X, y, sensitive_features=None):
+    # fit one shard in a worker process, only the indices of its support vectors are sent back
+    estimator.fit(X, y, sensitive_features)
+    return estimator.sv_index
+
+
+def subset(sensible_feature, idx):
+    return None if sensible_feature is None else sensible_feature[idx]
+
+
+class ShardedPFERM(BaseEstimator):
+    '''
+    Divide and conquer training of PFERM, in the spirit of the cascade SVM: the training set is split into
+    n_shards shards stratified by label and sensitive group, every shard is fitted in a worker process and
+    the model is refitted on the union of the support vectors of the shards. The fairness rows of the refit
+    keep the group means of the whole training set, evaluated at the merged support vectors (see
+    PFERM.fit_subset), so that they still describe the groups.
+    :param estimator: the PFERM (or FERM) fitted on the shards and on the merged set, its sensible_feature
+    is a column index of X or the values of the whole training set, unless sensitive_features is given to fit.
+    :param n_shards: the number of shards.
+    :param n_jobs: the number of worker processes, None for all the cores (at most n_shards), 1 fits the shards
+    in this process. Unless the estimator sets n_threads, the cores are split evenly between the workers as
+    their BLAS threads.
+    :param random_state: the seed of the assignment of the samples to the shards.
+    '''
+    def __init__(self, estimator=None, n_shards=4, n_jobs=None, random_state=None):
+        self.estimator = estimator
+        self.n_shards = n_shards
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def _shards(self, y, sensible_feature):
+        # every (label, group) stratum is shuffled and dealt round robin to the shards
+        rng = np.random.RandomState(self.random_state)
+        strata = y if sensible_feature is None else np.stack([y, sensible_feature], axis=1)
+        _, stratum = np.unique(strata, axis=0, return_inverse=True)
+        shard = np.empty(len(y), dtype=int)
+        start = 0
+        for k in range(stratum.max() + 1):
+            members = rng.permutation(np.flatnonzero(stratum.ravel() == k))
+            shard[members] = (start + np.arange(len(members))) % self.n_shards
+            start += len(members)
+        return [np.flatnonzero(shard == k) for k in range(self.n_shards)]
+
+    def fit(self, X, y, sensitive_features=None):
+        estimator = PFERM() if self.estimator is None else self.estimator
+        if estimator.kernel_approx is not None or estimator.solver == 'primal':
+            raise ValueError('the shards need a dual solver, their support vectors are merged')
+        X, y = np.asarray(X), np.asarray(y)
+        # every shard receives the sensitive feature of its own samples as a fit parameter
+        sensible_feature = estimator._sensitive(X, sensitive_features)
+
+        shards = self._shards(y, sensible_feature)
+        n_jobs, n_threads = split_cores(self.n_jobs, len(shards), estimator.n_threads)
+        jobs = [(clone(estimator).set_params(n_threads=n_threads), X[idx], y[idx],
+                 subset(sensible_feature, idx)) for idx in shards]
+        if self.n_jobs == 1:
+            sv_index = [fit_shard(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                sv_index = list(pool.map(fit_shard, *zip(*jobs)))
+
+        # refit on the union of the support vectors of the shards, with the group means of the whole training
+        # set: the support vectors alone are biased toward the margin and their groups are not the ones of X
+        self.support_index = np.unique(np.concatenate([idx[sv] for idx, sv in zip(shards, sv_index)]))
+        self.shard_sizes = [len(idx) for idx in shards]
+        self.shard_n_sv = [len(sv) for sv in sv_index]
+        self.model = clone(estimator)
+        self.model.fit_subset(X, y, self.support_index, sensible_feature)
+        return self
+
+    def decision_function(self, X):
+        return self.model.decision_function(X)
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+    def score(self, X_test, y_test):
+        return accuracy_score(y_test, self.predict(X_test))
@@ -0,0 +1,772 @@
+import numpy as np
+import cvxopt
+import cvxopt.solvers
+from scipy.linalg import blas, lapack, cho_factor, cho_solve
+import time
+import warnings
+from collections import OrderedDict
+from sklearn.exceptions import ConvergenceWarning
+
+
+class KernelRowCache:
+    # LRU cache of kernel rows (as in libsvm), the n x n Gram matrix is never built
+    def __init__(self, fkernel, X, cache_size=200, dtype=np.double):
+        self.fkernel = fkernel
+        self.X = X
+        self.dtype = dtype  # the rows are stored in dtype, np.float32 fits twice as many
+        # number of rows fitting in cache_size MB, at least the two rows of a working pair
+        self.capacity = max(2, int(cache_size * 2 ** 20 // (np.dtype(dtype).itemsize * len(X))))
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return len(self.rows) * len(self.X) * np.dtype(self.dtype).itemsize
+
+    def row(self, i):
+        if i in self.rows:
+            self.rows.move_to_end(i)
+            self.hits += 1
+            return self.rows[i]
+        self.misses += 1
+        row = np.ravel(np.asarray(self.fkernel(self.X[i:i + 1], self.X), dtype=self.dtype))
+        self.rows[i] = row
+        if len(self.rows) > self.capacity:
+            self.rows.popitem(last=False)
+        return row
+
+    def block(self, idx):
+        # the len(idx) x n block of rows K[idx], the missing rows are evaluated by a single kernel call
+        block = np.empty((len(idx), len(self.X)), dtype=self.dtype)
+        missing = []
+        for k, i in enumerate(idx):
+            if i in self.rows:
+                self.rows.move_to_end(i)
+                block[k] = self.rows[i]
+            else:
+                missing.append(k)
+        self.hits += len(idx) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            block[missing] = self.fkernel(self.X[np.asarray(idx)[missing]], self.X)
+            for k in missing:
+                self.rows[idx[k]] = block[k].copy()
+                if len(self.rows) > self.capacity:
+                    self.rows.popitem(last=False)
+        return block
+
+
+class DenseRows:
+    # the rows of a Gram matrix already in memory, with the interface of KernelRowCache
+    def __init__(self, K):
+        self.K = K
+
+    @property
+    def nbytes(self):
+        return 0  # no memory beyond K
+
+    def row(self, i):
+        return self.K[i]
+
+    def block(self, idx):
+        return self.K[idx]
+
+
+class BlockedKernel:
+    # Matrix-free access to K through products K V evaluated over blocks of block_size rows, only a
+    # block_size x n slice of K exists at any time and each block is a BLAS matrix product
+    def __init__(self, fkernel, X, block_size=1000, dtype=np.double):
+        self.fkernel = fkernel
+        self.X = X
+        self.block_size = block_size
+        self.dtype = dtype
+
+    @property
+    def nbytes(self):
+        # the largest block of K held during a product
+        return min(self.block_size, len(self.X)) * len(self.X) * np.dtype(self.dtype).itemsize
+
+    def blocks(self):
+        for start in range(0, len(self.X), self.block_size):
+            end = min(start + self.block_size, len(self.X))
+            yield start, end, np.asarray(self.fkernel(self.X[start:end], self.X), dtype=self.dtype)
+
+    def dot(self, V):
+        # only the columns of K matching the nonzero rows of V are evaluated, the multipliers of the
+        # samples outside the margin are zero
+        V = np.asarray(V, dtype=np.double)
+        nonzero = np.flatnonzero(np.any(V.reshape(len(V), -1) != 0, axis=1))
+        # V is cast to the dtype of the blocks, which are never upcast, the products are accumulated in double
+        X_nonzero, V = self.X[nonzero], V[nonzero].astype(self.dtype)
+        KV = np.zeros((len(self.X),) + V.shape[1:])
+        if len(nonzero) == 0:
+            return KV
+        for start in range(0, len(self.X), self.block_size):
+            end = min(start + self.block_size, len(self.X))
+            KV[start:end] = np.asarray(self.fkernel(self.X[start:end], X_nonzero), dtype=self.dtype).dot(V)
+        return KV
+
+    def norm_bound(self):
+        # max_i sum_j |K_ij| bounds the largest eigenvalue of K (Gershgorin)
+        bound = 0.0
+        for start, end, K_block in self.blocks():
+            bound = max(bound, np.max(np.sum(np.abs(K_block), axis=1)))
+        return bound
+
+
+def upper_bound(C, n):
+    # the upper bound of the n multipliers: inf for None, a float for a scalar C, or the array of the bounds
+    # of every multiplier (C * sample_weight for weighted samples)
+    if C is None:
+        return np.inf
+    if np.ndim(C) == 0:
+        return float(C)
+    C = np.asarray(C, dtype=np.double)
+    if C.shape != (n,):
+        raise ValueError('{} upper bounds for {} multipliers'.format(len(C), n))
+    return C
+
+
+def warn_unconverged(name, solution, tol, feas_tol):
+    # a solve stopped by its iteration budget (or stalled) is reported, as sklearn does for its own solvers
+    if solution['status'] != 'optimal':
+        warnings.warn('{} did not converge in {} iterations: KKT violation {:.2e} (tol {:.2e}), violation of the '
+                      'equality rows {:.2e} (feas_tol {:.2e})'.format(
+                          name, solution['iterations'], solution['dual infeasibility'], tol,
+                          solution['primal infeasibility'], feas_tol), ConvergenceWarning)
+
+
+def project_box_equalities(v, A, C, theta=None, tol=1e-12, max_iter=100):
+    '''
+    Euclidean projection of v on {0 <= a <= C, A a = 0}: a = clip(v - A^T theta, 0, C) where the multipliers
+    theta of the rows of A maximize the concave dual 1/2 ||a - v||^2 + theta^T A a, whose gradient is A a.
+    They are found by a semismooth Newton method with backtracking, the generalized Hessian being the Gram
+    matrix A_f A_f^T of the rows restricted to the free coordinates (regularized by a fraction of A A^T).
+    :param v: the point to project.
+    :param A: the p x n matrix of the equality rows, e.g. the balance row y and the fairness rows F.
+    :param C: the upper bound of a, a scalar or one per coordinate.
+    :param theta: the multipliers of a previous projection used as warm start.
+    :param tol: stopping tolerance on max |A a| relative to the magnitude of the products A v.
+    :return: the projection a and the multipliers theta.
+    '''
+    p = len(A)
+    theta = np.zeros(p) if theta is None else theta.copy()
+    scale = tol * (1 + np.max(np.abs(A).dot(np.abs(v))))
+    regularization = 1e-8 * A.dot(A.T) + 1e-14 * np.eye(p)
+
+    def dual(theta):
+        w = v - A.T.dot(theta)
+        a = np.clip(w, 0.0, C)
+        Aa = A.dot(a)
+        return w, a, Aa, 0.5 * np.dot(a - v, a - v) + np.dot(theta, Aa)
+
+    w, a, Aa, value = dual(theta)
+    for _ in range(max_iter):
+        if np.max(np.abs(Aa)) <= scale:
+            break
+        A_free = A[:, (w > 0) & (w < C)]
+        step = np.linalg.solve(A_free.dot(A_free.T) + regularization, Aa)
+        slope, t = np.dot(Aa, step), 1.0
+        while t > 1e-12:
+            w_new, a_new, Aa_new, value_new = dual(theta + t * step)
+            if value_new >= value + 1e-4 * t * slope:
+                break
+            t /= 2
+        else:
+            break  # no ascent left at the accuracy of the floating point
+        theta, w, a, Aa, value = theta + t * step, w_new, a_new, Aa_new, value_new
+    return a, theta
+
+
+def apg_solve(kernel, y, C=None, F=None, tol=1e-3, feas_tol=1e-6, max_iter=10000, init=None):
+    '''
+    Matrix-free solver of the (P)FERM dual
+        min 1/2 a^T Q a - 1^T a,  Q = (y y^T) * K
+        s.t. 0 <= a <= C, y^T a = 0, F a = 0
+    by accelerated projected gradient (FISTA with adaptive restart). The iterates are projected on the
+    box, the balance row and the fairness rows at once by project_box_equalities, so every iterate is
+    feasible and the step 1 / L stays the one of K: a penalty on the fairness rows (as in smo_solve) would
+    add rho * ||F||^2 to L and slow down every iteration as rho grows.
+    Every iteration costs one product K v, so the memory is the one of a block of rows of K and the time
+    is spent in blocked BLAS calls.
+    :param kernel: a BlockedKernel providing the products K v.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier, None means no upper bound.
+    :param F: the (g-1) x n matrix of the fairness rows, None if there is no fairness constraint.
+    :param tol: stopping tolerance on the projected gradient max |a - proj(a - grad / L)| * L.
+    :param feas_tol: tolerance on the violation of the balance and fairness rows left by the projections.
+    :param init: a previous solution on the same K and F used as warm start, its multipliers must lie
+    in the box of C.
+    :return: a dictionary as the one of smo_solve, 'x' holds the multipliers a, 'Qa' the vector Q a and 'nu'
+    the multipliers of the fairness rows. A ConvergenceWarning is issued if max_iter is reached first.
+    '''
+    y = np.asarray(y, dtype=np.double)
+    if not np.all(np.abs(y) == 1):
+        raise ValueError('The APG solver needs labels in {-1, 1}')
+    n = len(y)
+    C = upper_bound(C, n)
+    F = np.zeros((0, n)) if F is None else np.atleast_2d(np.asarray(F, dtype=np.double))
+    A = np.vstack([y, F])  # the equality rows of the projection
+
+    L = kernel.norm_bound()
+    if init is not None and np.all(init['x'] <= C):
+        a = init['x'].copy()
+        Qa = init['Qa'].copy()
+        theta = np.concatenate([[0.0], init['nu'] / L])
+    else:
+        a = np.zeros(n)
+        Qa = np.zeros(n)
+        theta = np.zeros(len(A))  # multipliers of the rows of A, scaled by 1 / L
+    iterations, residual = 0, np.inf
+    z, Qz, t = a, Qa, 1.0
+    while iterations < max_iter:
+        grad = Qz - 1.0
+        a_new, theta = project_box_equalities(z - grad / L, A, C, theta)
+        Qa_new = y * kernel.dot(y * a_new)
+        iterations += 1
+
+        residual = L * np.max(np.abs(a_new - z))
+        if np.dot(grad, a_new - a) > 0:  # restart the momentum when the objective goes up
+            t = 1.0
+        t_new = (1 + np.sqrt(1 + 4 * t ** 2)) / 2
+        beta = (t - 1) / t_new
+        z, Qz = a_new + beta * (a_new - a), Qa_new + beta * (Qa_new - Qa)
+        a, Qa, t = a_new, Qa_new, t_new
+        if residual < tol:
+            break
+
+    feas = np.max(np.abs(A.dot(a)))
+    converged = residual < tol and feas <= feas_tol
+    solution = {'x': a, 'Qa': Qa, 'nu': L * theta[1:], 'status': 'optimal' if converged else 'unknown',
+                'iterations': iterations, 'primal infeasibility': feas, 'dual infeasibility': residual}
+    warn_unconverged('apg_solve', solution, tol, feas_tol)
+    return solution
+
+
+# the working sets are small, their sub-QPs are solved to high accuracy so that the multipliers which end
+# on a bound are recognized by snap_to_box
+SUB_QP_OPTIONS = {'show_progress': False, 'abstol': 1e-10, 'reltol': 1e-10, 'feastol': 1e-10}
+
+
+def snap_to_box(x, A, b, C, eps=1e-6):
+    # the interior point solution only approaches the bounds, the multipliers within eps * C of a bound are
+    # moved onto it (so they leave I_up or I_low) and the equality rows A x = b are restored by the least
+    # norm correction of the free ones
+    C = np.broadcast_to(C, x.shape)
+    bound = np.where(np.isinf(C), 1.0, C)
+    x = np.where(x < eps * bound, 0.0, x)
+    x = np.where(x > C - eps * bound, C, x)
+    free = np.flatnonzero((x > 0) & (x < C))
+    if len(free):
+        A_free = A[:, free]
+        shift = np.linalg.lstsq(A_free.dot(A_free.T), A.dot(x) - b, rcond=None)[0]
+        x[free] = np.clip(x[free] - A_free.T.dot(shift), 0.0, C[free])
+    return x
+
+
+def decomposition_solve(cache, y, C=None, F=None, working_set_size=200, tol=1e-3, feas_tol=1e-6, max_iter=None,
+                        init=None):
+    '''
+    Working set decomposition (chunking) solver of the (P)FERM dual
+        min 1/2 a^T Q a - 1^T a,  Q = (y y^T) * K
+        s.t. 0 <= a <= C, y^T a = 0, F a = 0
+    Every iteration brings into the working set B the multipliers that violate the KKT conditions the
+    most, half from each side of the maximal violating pair, completes B with the free multipliers of the
+    previous working set as in SVMlight, and solves the sub-QP on B with box_qp while the other multipliers
+    stay fixed, so the balance and the fairness rows become the fixed offsets y_B^T a_B = -y_N^T a_N and
+    F_B a_B = -F_N a_N. A warm start solved for other fairness rows is repaired by the first sub-QPs, every
+    later iterate is feasible, and the multipliers nu of the fairness rows in the last sub-QP price them in
+    the KKT conditions of the samples outside B. A working set that repeats is doubled until it brings in
+    new violators or covers all the samples. A penalty on the fairness rows
+    (as in smo_solve) would make the sub-QPs ill conditioned as it grows, so that even a working set
+    covering all the samples would not close the gap.
+    Each iteration needs the rows K[B], the missing ones evaluated by one blocked kernel call, and an
+    O(q^3) sub-solve instead of the O(n^3) of the full QP.
+    :param cache: a KernelRowCache providing the rows of K.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier, None means no upper bound.
+    :param F: the (g-1) x n matrix of the fairness rows, None if there is no fairness constraint.
+    :param working_set_size: the initial size q of the working set.
+    :param tol: stopping tolerance on the maximal violating pair (as in libsvm).
+    :param feas_tol: stopping tolerance on the violation of the balance and fairness rows max |y^T a|, |F a|.
+    :param init: a previous solution on the same K used as warm start, its multipliers must lie in the box of
+    C, its fairness rows may differ from F.
+    :return: a dictionary as the one of smo_solve, 'x' holds the multipliers a and 'Qa' the vector Q a. A
+    ConvergenceWarning is issued if the gap is still above tol at max_iter or when even the sub-QP on all the
+    samples cannot close it.
+    '''
+    y = np.asarray(y, dtype=np.double)
+    if not np.all(np.abs(y) == 1):
+        raise ValueError('The decomposition solver needs labels in {-1, 1}')
+    n = len(y)
+    C_box = upper_bound(C, n)
+    C_n = np.broadcast_to(C_box, (n,))  # the bound of every multiplier, for the sub-QPs
+    F = np.zeros((0, n)) if F is None else np.atleast_2d(np.asarray(F, dtype=np.double))
+    A = np.vstack([y, F])  # the equality rows of the sub-QPs
+    q = min(n, max(working_set_size, 2))
+    q_new = max(2, q // 2)  # multipliers entering the working set at every iteration
+    if max_iter is None:
+        max_iter = max(1000, 100 * n // q)
+
+    if init is not None and np.all(init['x'] <= C_box):
+        a = init['x'].copy()
+        Qa = init['Qa'].copy()
+        nu = init['nu'].copy()
+    else:
+        a = np.zeros(n)
+        Qa = np.zeros(n)
+        nu = np.zeros(len(F))  # multipliers of the fairness rows
+    def working_set(yg, I_up, I_low, last_B, q, q_new):
+        # the q_new / 2 largest yg in I_up and the q_new / 2 smallest in I_low, completed by the free multipliers
+        # of the previous working set (as in SVMlight) to damp the zigzagging
+        up, low = np.flatnonzero(I_up), np.flatnonzero(I_low)
+        B = np.union1d(up[np.argsort(-yg[up], kind='stable')[:q_new // 2]],
+                       low[np.argsort(yg[low], kind='stable')[:q_new - q_new // 2]])
+        if last_B is not None:
+            kept = last_B[(a[last_B] > 0) & (a[last_B] < C_n[last_B]) & ~np.isin(last_B, B)]
+            B = np.union1d(B, kept[:q - len(B)])
+        return B
+
+    iterations, gap, feas, last_B = 0, np.inf, np.inf, None
+    while iterations < max_iter:
+        grad = Qa - 1.0 + F.T.dot(nu)
+        yg = -y * grad
+        I_up = np.where(y > 0, a < C_box, a > 0)
+        I_low = np.where(y > 0, a > 0, a < C_box)
+        gap = np.max(np.where(I_up, yg, -np.inf)) - np.min(np.where(I_low, yg, np.inf))
+        # a warm start solved for other fairness rows (fit_sweep, partial_fit) leaves a residual A a, which
+        # the sub-QPs drive back to zero
+        residual = A.dot(a)
+        feas = np.max(np.abs(residual))
+        if gap < tol and feas <= feas_tol:
+            break
+
+        # a working set equal to the last one has its sub-QP solved already, the next most violating
+        # multipliers are brought in by doubling the working set until it covers all the samples
+        B = working_set(yg, I_up, I_low, last_B, q, q_new)
+        while last_B is not None and np.array_equal(B, last_B) and q < n:
+            q, q_new = min(n, 2 * q), min(n, 2 * q_new)
+            B = working_set(yg, I_up, I_low, last_B, q, q_new)
+        if last_B is not None and np.array_equal(B, last_B):
+            break  # even the sub-QP on all the samples leaves the gap, reported below
+        last_B = B
+
+        # sub-QP on B: min 1/2 x^T Q_BB x + (Qa_B - 1 - Q_BB a_B)^T x, 0 <= x <= C, A_B x = A_B a_B - A a
+        K_B = cache.block(B).T
+        Q_BB = np.outer(y[B], y[B]) * K_B[B]
+        offsets = A[:, B].dot(a[B]) - residual
+        solution = box_qp(Q_BB, Qa[B] - 1.0 - Q_BB.dot(a[B]), A[:, B], offsets, None if C is None else C_n[B],
+                          options=SUB_QP_OPTIONS)
+        x = snap_to_box(np.ravel(solution['x']), A[:, B], offsets, C_n[B])
+        nu = np.ravel(solution['y'])[1:]
+
+        Qa += y * K_B.dot(y[B] * (x - a[B]))
+        a[B] = x
+        iterations += 1
+
+    feas = np.max(np.abs(A.dot(a)))
+    converged = gap < tol and feas <= feas_tol
+    solution = {'x': a, 'Qa': Qa, 'nu': nu, 'status': 'optimal' if converged else 'unknown',
+                'iterations': iterations, 'primal infeasibility': feas, 'dual infeasibility': gap}
+    warn_unconverged('decomposition_solve', solution, tol, feas_tol)
+    return solution
+
+
+def smo_solve(cache, diag, y, C=None, F=None, tol=1e-3, feas_tol=1e-6, rho=1.0, max_rho=1e6, max_iter=None,
+              max_outer=100, init=None):
+    '''
+    SMO solver of the (P)FERM dual
+        min 1/2 a^T Q a - 1^T a,  Q = (y y^T) * K
+        s.t. 0 <= a <= C, y^T a = 0, F a = 0
+    where the rows of F are the fairness rows y * tau. The balance row y^T a = 0 is kept exactly by
+    the working pairs, the fairness rows are handled by an augmented Lagrangian whose penalty
+    rho * F^T F is a rank-(g-1) term, so every inner step only needs two kernel rows.
+    :param cache: a KernelRowCache providing the rows of K.
+    :param diag: the diagonal of K.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier, None means no upper bound.
+    :param F: the (g-1) x n matrix of the fairness rows, None if there is no fairness constraint.
+    :param tol: stopping tolerance on the maximal violating pair (as in libsvm).
+    :param feas_tol: stopping tolerance on the violation of the fairness rows |F a|.
+    :param rho: the initial penalty of the augmented Lagrangian, multiplied by 10 (up to max_rho) by every
+    outer iteration that does not reduce |F a| fourfold.
+    :param max_iter: the budget of pair updates over all the outer iterations, by default max(1e5, 100 n),
+    some seconds for the problems of the paper (a C=None fit of non separable data never converges).
+    :param init: a previous solution on the same K and F used as warm start, its multipliers must lie
+    in the box of C (e.g. a solution for a smaller C).
+    :return: a dictionary in the spirit of cvxopt.solvers.qp, 'x' holds the multipliers a and
+    'Qa' the vector Q a, which is needed by the intercept. A ConvergenceWarning is issued if max_iter is
+    reached first.
+    '''
+    y = np.asarray(y, dtype=np.double)
+    if not np.all(np.abs(y) == 1):
+        raise ValueError('The SMO solver needs labels in {-1, 1}')
+    n = len(y)
+    C = upper_bound(C, n)
+    C_n = np.broadcast_to(C, (n,))  # the bound of every multiplier, for the pair updates
+    F = np.zeros((0, n)) if F is None else np.atleast_2d(np.asarray(F, dtype=np.double))
+    yF = F * y  # yF[:, t] is the change of F a when a_t moves along y_t
+    if max_iter is None:
+        max_iter = max(100000, 100 * n)
+
+    if init is not None and np.all(init['x'] <= C):
+        a = init['x'].copy()
+        Qa = init['Qa'].copy()
+        nu = init['nu'].copy()
+    else:
+        a = np.zeros(n)
+        Qa = np.zeros(n)
+        nu = np.zeros(len(F))  # multipliers of the fairness rows
+    Fa = F.dot(a)
+    iterations, gap = 0, np.inf
+    last_feas = np.inf
+    for outer in range(max_outer):
+        while iterations < max_iter:
+            grad = Qa - 1.0 + F.T.dot(nu + rho * Fa)
+            yg = -y * grad
+            I_up = np.where(y > 0, a < C, a > 0)
+            I_low = np.where(y > 0, a > 0, a < C)
+            i = np.argmax(np.where(I_up, yg, -np.inf))
+            gap = yg[i] - np.min(np.where(I_low, yg, np.inf))
+            if gap < tol:
+                break
+
+            # second order working set selection (Fan et al., 2005) with the curvature of the
+            # moving pair on K plus the low rank penalty
+            K_i = cache.row(i)
+            b_it = yg[i] - yg
+            curv = diag[i] + diag - 2 * K_i
+            if len(F):
+                curv += rho * np.sum((yF[:, [i]] - yF) ** 2, axis=0)
+            curv = np.maximum(curv, 1e-12)
+            j = np.argmax(np.where(I_low & (b_it > 0), b_it ** 2 / curv, -np.inf))
+            K_j = cache.row(j)
+
+            # a_i moves by y_i * t and a_j by -y_j * t, clipped to the box
+            t = b_it[j] / curv[j]
+            t = min(t, C_n[i] - a[i] if y[i] > 0 else a[i], a[j] if y[j] > 0 else C_n[j] - a[j])
+            a[i] = min(max(a[i] + y[i] * t, 0.0), C_n[i])
+            a[j] = min(max(a[j] - y[j] * t, 0.0), C_n[j])
+            Qa += t * y * (K_i - K_j)
+            Fa += t * (yF[:, i] - yF[:, j])
+            iterations += 1
+
+        feas = np.max(np.abs(Fa)) if len(F) else 0.0
+        if feas <= feas_tol or iterations >= max_iter:
+            break
+        nu += rho * Fa
+        if feas > 0.25 * last_feas:
+            rho = min(10 * rho, max(max_rho, rho))
+        last_feas = feas
+
+    converged = gap < tol and feas <= feas_tol
+    solution = {'x': a, 'Qa': Qa, 'nu': nu, 'rho': rho, 'status': 'optimal' if converged else 'unknown',
+                'iterations': iterations, 'primal infeasibility': feas, 'dual infeasibility': gap}
+    warn_unconverged('smo_solve', solution, tol, feas_tol)
+    return solution
+
+
+def penalty_solve(cache, diag, y, C=None, F=None, mu=1.0, tol=1e-3, max_iter=None, init=None):
+    '''
+    Dual coordinate descent on the penalized (P)FERM dual
+        min 1/2 a^T (Q + mu F^T F) a - 1^T a,  Q = (y y^T) * K
+        s.t. 0 <= a <= C, y^T a = 0
+    where the fairness rows F only enter the objective by the rank-(g-1) penalty. Only the box and the
+    balance row are left, so the problem is solved by updates of pairs of multipliers (the smallest moves
+    keeping y^T a = 0) in a single pass of the inner loop of smo_solve, with no multiplier of F to update.
+    :param cache: a KernelRowCache providing the rows of K.
+    :param diag: the diagonal of K.
+    :param y: the labels, in {-1, 1}.
+    :param C: the upper bound of a, a scalar or one per multiplier, None means no upper bound.
+    :param F: the (g-1) x n matrix of the fairness rows, None if there is no fairness penalty.
+    :param mu: the weight of the penalty, the larger mu the closer F a gets to 0.
+    :param tol: stopping tolerance on the maximal violating pair.
+    :param init: a previous solution on the same K and F used as warm start.
+    :return: a dictionary as returned by smo_solve, 'primal infeasibility' being the violation |F a| left
+    by the penalty.
+    '''
+    n_rows = 0 if F is None else len(np.atleast_2d(F))
+    if init is not None:
+        init = dict(init, nu=np.zeros(n_rows))
+    return smo_solve(cache, diag, y, C, F, tol=tol, feas_tol=np.inf, rho=mu, max_iter=max_iter, max_outer=1,
+                     init=init)
+
+
+def box_qp(P, q, A, b, C=None, block_size=1000, options=None):
+    '''
+    Solve the QP
+        min 1/2 x^T P x + q^T x
+        s.t. 0 <= x <= C, A x = b
+    with cvxopt.solvers.qp without building the dense 2n x n box matrix G = [-I; I]. P and G are
+    passed to cvxopt as functions and the KKT systems are solved by exploiting the diagonal
+    structure of the box constraints and the few rows of A (the balance and the fairness rows).
+    :param P: the n x n numpy array of the quadratic term. A C-contiguous double P is used as workspace
+    without copy and restored on return.
+    :param q: the linear term.
+    :param A: the p x n numpy array of the equality constraints.
+    :param b: the right hand side of the equality constraints.
+    :param C: the upper bound of x, a scalar or one per variable, None means only x >= 0.
+    :param options: the cvxopt options of this solve, cvxopt.solvers.options is left untouched.
+    :return: the solution dictionary of cvxopt.solvers.qp.
+    '''
+    n = len(q)
+    P = np.ascontiguousarray(P, dtype=np.double)
+    A = np.atleast_2d(np.asarray(A, dtype=np.double))
+    n_box = n if C is None else 2 * n
+
+    # P is kept in the strict upper triangle of M plus p_diag, the lower triangle and the diagonal
+    # of M hold the Cholesky factor of P + G^T W^{-2} G, so a single n x n buffer is needed
+    M = P.T
+    p_diag = np.diag(P).copy()
+
+    def fP(x, y, alpha=1.0, beta=0.0):
+        x, y = np.ravel(x), np.asarray(y)[:, 0]
+        Px = blas.dsymv(1.0, M, x, lower=0) + (p_diag - np.diagonal(M)) * x
+        y *= beta
+        y += alpha * Px
+
+    def fG(x, y, trans='N', alpha=1.0, beta=0.0):
+        x, y = np.ravel(x), np.asarray(y)[:, 0]
+        y *= beta
+        if trans == 'N':  # G x = [-x; x]
+            y[:n] -= alpha * x[:n]
+            if C is not None:
+                y[n:] += alpha * x
+        else:  # G^T z = -z_1 + z_2
+            y -= alpha * x[:n]
+            if C is not None:
+                y += alpha * x[n:]
+
+    # the tiles of restore_P, capped at n / 32 rows so that their few temporaries stay within ~1% of P
+    tile = min(block_size, max(1, n // 32))
+
+    def restore_P(diag):
+        # copy the strict upper triangle of M to its lower triangle and set its diagonal, tile by tile so that
+        # the temporaries are tile x tile whatever n
+        for start in range(0, n, tile):
+            end = min(start + tile, n)
+            for tile_start in range(end, n, tile):
+                tile_end = min(tile_start + tile, n)
+                M[tile_start:tile_end, start:end] = M[start:end, tile_start:tile_end].T
+            block = M[start:end, start:end]
+            block[:] = np.triu(block) + np.triu(block, 1).T
+        M[np.diag_indices(n)] = diag
+
+    def kktsolver(W):
+        d = np.ravel(W['d'])
+        s = 1.0 / d[:n] ** 2
+        if C is not None:
+            s += 1.0 / d[n:] ** 2
+
+        # restore the lower triangle from the upper one and factor H = P + diag(s) in place
+        restore_P(p_diag + s)
+        _, info = lapack.dpotrf(M, lower=1, clean=0, overwrite_a=1)
+        if info != 0:
+            raise ArithmeticError('singular KKT system')
+
+        # Schur complement A H^{-1} A^T of the equality constraints
+        HinvAt, _ = lapack.dpotrs(M, A.T, lower=1)
+        S = A.dot(HinvAt)
+
+        def f(x, y, z):
+            xv, yv, zv = np.asarray(x)[:, 0], np.asarray(y)[:, 0], np.asarray(z)[:, 0]
+            # eliminate uz = W^{-2} (G ux - bz) from the first block row
+            rx = xv - zv[:n] / d[:n] ** 2
+            if C is not None:
+                rx += zv[n:] / d[n:] ** 2
+            w, _ = lapack.dpotrs(M, rx, lower=1)
+            uy = np.linalg.solve(S, A.dot(w) - yv)
+            ux = w - HinvAt.dot(uy)
+            # z returns the scaled W uz = W^{-1} (G ux - bz)
+            zv[:n] = (-ux - zv[:n]) / d[:n]
+            if C is not None:
+                zv[n:] = (ux - zv[n:]) / d[n:]
+            xv[:] = ux
+            yv[:] = uy
+
+        return f
+
+    h = np.zeros(n_box)
+    if C is not None:
+        h[n:] = C
+    try:
+        return cvxopt.solvers.qp(fP, cvxopt.matrix(np.asarray(q, dtype=np.double)), fG, cvxopt.matrix(h),
+                                 cvxopt.matrix(A), cvxopt.matrix(np.asarray(b, dtype=np.double)),
+                                 kktsolver=kktsolver, options=dict(cvxopt.solvers.options, **(options or {})))
+    finally:
+        # the lower triangle and the diagonal hold the last Cholesky factor
+        restore_P(p_diag)
+
+
+class DualProblem:
+    '''
+    The (P)FERM dual, independent of the solver
+        min 1/2 a^T P a + q^T a,  P = (y y^T) * K, q = -1
+        s.t. 0 <= a <= C, A a = 0
+    where the rows of A are the balance row y and the fairness rows, or in the penalized form
+        P = (y y^T) * K + mu * F^T F
+    where the fairness rows F leave A.
+    :param K: the Gram matrix.
+    :param y: the labels, in {-1, 1}.
+    :param fairness_rows: the (g-1) x n matrix of the fairness rows y * tau, None without fairness constraint.
+    :param C: the upper bound of a, a scalar or one per multiplier, None means no upper bound.
+    :param overwrite_K: let a backend form P in place over K, see P.
+    :param penalty_rows: the fairness rows F moved into the objective.
+    :param mu: the weight of the penalty.
+    '''
+    def __init__(self, K, y, fairness_rows=None, C=None, overwrite_K=False, penalty_rows=None, mu=1.0):
+        self.K = K
+        self.overwrite_K = overwrite_K
+        self.penalty_rows = None if penalty_rows is None \
+            else np.atleast_2d(np.asarray(penalty_rows, dtype=np.double))
+        self.mu = mu
+        self.y = np.asarray(y, dtype=np.double)
+        self.C = C
+        self.q = -np.ones(len(y))
+        self.A = self.y.reshape(1, -1)
+        if fairness_rows is not None:
+            self.A = np.vstack([self.A, fairness_rows])
+        self.b = np.zeros(len(self.A))
+
+    def P(self, in_place=False):
+        # P in double precision as the factorizations of the backends need. With in_place, overwrite_K, labels
+        # in {-1, 1} and a writeable C-contiguous double K, the rows and columns of K are scaled by y in place
+        # and P is K itself until restore_K, otherwise P is a new dense copy
+        K = self.K
+        if in_place and self.overwrite_K and self.penalty_rows is None and isinstance(K, np.ndarray) and K.dtype == np.double and K.flags.c_contiguous \
+                and K.flags.writeable and np.all(np.abs(self.y) == 1):
+            K *= self.y[:, np.newaxis]
+            K *= self.y
+            return K
+        P = np.outer(self.y, self.y) * K
+        if self.penalty_rows is not None:
+            for row in self.penalty_rows:  # rank-one updates in place, P is symmetric
+                blas.dger(self.mu, row, row, a=P.T, overwrite_a=True)
+        return P
+
+    def restore_K(self, P):
+        # undo the sign scaling of a P formed in place, exact since y is in {-1, 1}
+        if P is self.K:
+            P *= self.y[:, np.newaxis]
+            P *= self.y
+
+    def P_dot(self, x):
+        # the product runs in the dtype of K, a single precision K is not upcast
+        Px = self.y * np.dot(self.K, (self.y * x).astype(self.K.dtype, copy=False))
+        if self.penalty_rows is not None:
+            Px += self.mu * self.penalty_rows.T.dot(self.penalty_rows.dot(x))
+        return Px
+
+
+def cvxopt_backend(problem, init=None, workspace=None, **options):
+    # the interior point solver of cvxopt, it has no use for a warm start. box_qp works over the buffer of P
+    # and restores it, so P can be K itself
+    start = time.perf_counter()
+    P = problem.P(in_place=True)
+    assembly_time = time.perf_counter() - start
+    try:
+        solution = box_qp(P, problem.q, problem.A, problem.b, problem.C,
+                          options=dict({'show_progress': False}, **options))
+    finally:
+        problem.restore_K(P)
+    workspace_bytes = 0 if P is problem.K else P.nbytes
+    return dict(solution, x=np.ravel(solution['x']), **{'assembly time': assembly_time,
+                                                        'workspace bytes': workspace_bytes})
+
+
+def admm_backend(problem, init=None, workspace=None, tol=1e-4, rho=None, rho_eq=1e3, sigma=1e-6, alpha=1.6,
+                 max_iter=10000, check_every=10):
+    '''
+    ADMM solver in the style of OSQP. The constraints are written as l <= [I; A] a <= u with z = [I; A] a,
+    so every iteration solves a linear system with the matrix
+        M = P + (sigma + rho) I + rho_eq A^T A
+    which does not depend on C nor on the iterate, it is factored once and kept in workspace for
+    the next solves on the same P and A (e.g. a path over C).
+    :param problem: a DualProblem.
+    :param init: a previous solution of this backend used as warm start.
+    :param workspace: a dictionary shared across solves to cache the factorization.
+    :param tol: absolute and relative tolerance on the primal and dual residuals, loose values (1e-2, 1e-3)
+    are enough to rank the candidates of a grid search.
+    :param rho: the penalty of the box rows, by default the mean of the diagonal of P (1 for the rbf kernel),
+    rho_eq is the one of the equality rows.
+    :param sigma: the proximal regularization keeping M positive definite.
+    :param alpha: the over-relaxation parameter, in (0, 2).
+    :param check_every: the residuals, which cost a product with P, are checked every check_every iterations.
+    :return: a dictionary in the spirit of cvxopt.solvers.qp, 'x' holds the solution a (in the box),
+    'z' and 'y' the ADMM iterates used by a warm start.
+    '''
+    n, p = len(problem.q), len(problem.A)
+    A, q = problem.A, problem.q
+    C = upper_bound(problem.C, n)
+    workspace = {} if workspace is None else workspace
+    if rho is None:
+        rho = float(np.mean(np.diagonal(problem.K)))
+
+    key = ('admm', id(problem.K), rho, rho_eq, sigma, A.tobytes())
+    assembly_time = 0.0
+    if workspace.get('key') != key:
+        workspace.clear()  # only the factorization of the current M is kept
+        start = time.perf_counter()
+        M = problem.P()
+        M += rho_eq * A.T.dot(A)
+        M[np.diag_indices(n)] += sigma + rho
+        assembly_time = time.perf_counter() - start
+        workspace['factor'] = cho_factor(M, lower=True, overwrite_a=True, check_finite=False)
+        workspace['key'] = key
+    factor = workspace['factor']
+
+    if init is not None and 'z' in init and len(init['z']) == n + p:
+        x, z, u = init['x'].copy(), init['z'].copy(), init['y'].copy()
+    else:
+        x, z, u = np.zeros(n), np.zeros(n + p), np.zeros(n + p)
+    z[:n] = np.clip(z[:n], 0.0, C)
+    z[n:] = problem.b
+    R = np.concatenate([np.full(n, rho), np.full(p, rho_eq)])
+
+    status, iterations, r_prim, r_dual = 'unknown', 0, np.inf, np.inf
+    while iterations < max_iter:
+        # x update by the cached factorization, z and the dual u by projection on the bounds
+        v = R * z - u
+        x_tilde = cho_solve(factor, sigma * x - q + v[:n] + A.T.dot(v[n:]), check_finite=False)
+        z_tilde = np.concatenate([x_tilde, A.dot(x_tilde)])
+        x = alpha * x_tilde + (1 - alpha) * x
+        z_relaxed = alpha * z_tilde + (1 - alpha) * z
+        z_new = z_relaxed + u / R
+        z_new[:n] = np.clip(z_new[:n], 0.0, C)
+        z_new[n:] = problem.b
+        u += R * (z_relaxed - z_new)
+        z = z_new
+        iterations += 1
+
+        if iterations % check_every == 0 or iterations == max_iter:
+            Ax = np.concatenate([x, A.dot(x)])
+            Px = problem.P_dot(x)
+            At_u = u[:n] + A.T.dot(u[n:])
+            r_prim = np.max(np.abs(Ax - z))
+            r_dual = np.max(np.abs(Px + q + At_u))
+            if r_prim <= tol * (1 + max(np.max(np.abs(Ax)), np.max(np.abs(z)))) and \
+                    r_dual <= tol * (1 + max(np.max(np.abs(Px)), np.max(np.abs(At_u)), 1.0)):
+                status = 'optimal'
+                break
+
+    return {'x': z[:n].copy(), 'z': z, 'y': u, 'status': status, 'iterations': iterations,
+            'primal infeasibility': r_prim, 'dual infeasibility': r_dual, 'assembly time': assembly_time,
+            'workspace bytes': factor[0].nbytes}
+
+
+# The loose tier of the tolerances of every solver, enough to rank the candidates of a grid search (see
+# tiered_search.TwoTierGridSearchCV), the defaults of the solvers being the full precision tier
+LOOSE_TOLERANCES = {'cvxopt': {'abstol': 1e-4, 'reltol': 1e-3, 'feastol': 1e-5},
+                    'admm': {'tol': 1e-2},
+                    'smo': {'tol': 1e-2, 'feas_tol': 1e-4},
+                    'decomposition': {'tol': 1e-2, 'feas_tol': 1e-4},
+                    'blocked': {'tol': 1e-2, 'feas_tol': 1e-4},
+                    'primal': {'tol': 1e-2}}
+
+
+# The backends of the dense dual, a backend takes a DualProblem, a previous solution as warm start, a
+# workspace dictionary shared across solves on the same problem and its own keyword options, and returns
+# a dictionary with the solution 'x' as a numpy array, optionally the time spent building its matrices
+# ('assembly time') and their size ('workspace bytes')
+QP_BACKENDS = {'cvxopt': cvxopt_backend, 'admm': admm_backend}
@@ -0,0 +1,26 @@
+import time
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, ParameterGrid
+
+
+class TwoTierGridSearchCV(GridSearchCV):
+    '''
+    GridSearchCV over FERM/PFERM with two tolerance tiers: every candidate of the grid is fitted and scored
+    with tol_tier='loose', early terminated solves that are enough to rank the candidates, and only the
+    selected configuration is refitted on the whole training set with tol_tier='full'.
+    cv_results_ holds the scores of the loose candidates and best_estimator_.fit_stats_['tol_tier'] the tier
+    of the final model. It takes the parameters of GridSearchCV.
+    '''
+    def _run_search(self, evaluate_candidates):
+        evaluate_candidates([dict(params, tol_tier='loose') for params in ParameterGrid(self.param_grid)])
+
+    def fit(self, X, y=None, **fit_params):
+        super().fit(X, y, **fit_params)
+        if self.refit:
+            # the refit of GridSearchCV solved the best candidate in the loose tier, solve it again to full precision
+            self.best_params_ = {key: value for key, value in self.best_params_.items() if key != 'tol_tier'}
+            start_time = time.perf_counter()
+            self.best_estimator_ = clone(self.best_estimator_).set_params(tol_tier='full')
+            self.best_estimator_.fit(X, y, **fit_params)
+            self.refit_time_ += time.perf_counter() - start_time
+        return self